@@ -0,0 +1,86 @@
+import numpy as np
+
+from coupling_function import coupling_function
+
+# Discretization of the bath into modes (frequency, coupling) for environment_hamiltonian,
+# interaction_hamiltonian, evolution_operator and spin_bath_propagator. Every mode stands for a
+# frequency bin: its coupling is coupling_function(frequency, bin width), evaluated on the whole grid
+# at once. The discrete bath enters the dynamics through its correlation function
+# C(t) = sum_k couplings_k**2 exp(-i frequencies_k t), which compress_bath keeps track of.
+
+def bin_edges(pulse_min, pulse_max, n_modes, scheme='linear', pulsec=100, alpha=0.0002, resolution=4096):
+    # Edges of the n_modes frequency bins of [pulse_min, pulse_max]:
+    #   'linear': equal widths
+    #   'logarithmic': equal ratios (pulse_min > 0), finer at low frequency
+    #   'equal-weight': equal coupling weight coupling_function**2 per bin, the weight density being
+    #       sampled on a grid of resolution points
+    if scheme == 'linear':
+        return np.linspace(pulse_min, pulse_max, n_modes + 1)
+    if scheme == 'logarithmic':
+        return np.geomspace(pulse_min, pulse_max, n_modes + 1)
+    if scheme == 'equal-weight':
+        grid = np.linspace(pulse_min, pulse_max, resolution + 1)
+        width = grid[1] - grid[0]
+        weights = coupling_function(grid[:-1] + width/2, width, pulsec, alpha)**2
+        cumulative = np.concatenate(([0], np.cumsum(weights)))
+        return np.interp(np.linspace(0, cumulative[-1], n_modes + 1), cumulative, grid)
+    raise ValueError('unknown discretization scheme {}'.format(scheme))
+
+def discretize_bath(pulse_min, pulse_max, n_modes, scheme='linear', pulsec=100, alpha=0.0002, anchor='center'):
+    # Frequencies and couplings of n_modes bath modes (see bin_edges for the schemes). The frequency of a
+    # mode is the center of its bin, or its lower edge with anchor='left', as the bath of main.ipynb:
+    # discretize_bath(0.8, 1.15, 6, anchor='left')
+    edges = bin_edges(pulse_min, pulse_max, n_modes, scheme, pulsec, alpha)
+    widths = np.diff(edges)
+    if anchor == 'center':
+        frequencies = edges[:-1] + widths/2
+    elif anchor == 'left':
+        frequencies = edges[:-1]
+    else:
+        raise ValueError('anchor must be center or left, not {}'.format(anchor))
+    return frequencies, coupling_function(frequencies, widths, pulsec, alpha)
+
+def compress_bath(frequencies, couplings, threshold, mode='merge'):
+    # Removes the modes whose coupling is below threshold:
+    #   'drop': they are discarded
+    #   'merge': every run of consecutive weak modes (in frequency order) becomes one mode carrying their
+    #       total weight sum g**2 at their weight averaged frequency
+    # Returns (frequencies, couplings, report), the report bounding the change of the bath correlation
+    # function: |C(t) - C_compressed(t)| <= dropped_weight + t*frequency_spread, with
+    #   dropped_weight = sum of g**2 of the dropped modes
+    #   frequency_spread = sum of g**2 |frequency - merged frequency| of the merged modes
+    # and the relative weight error dropped_weight / sum g**2
+    frequencies = np.asarray(frequencies, dtype=float)
+    couplings = np.asarray(couplings, dtype=float)
+    order = np.argsort(frequencies, kind='stable')
+    frequencies, couplings = frequencies[order], couplings[order]
+    weights = couplings**2
+    weak = np.abs(couplings) < threshold
+
+    if mode == 'drop':
+        kept_frequencies, kept_couplings = frequencies[~weak], couplings[~weak]
+        dropped, spread = weights[weak].sum(), 0.
+    elif mode == 'merge':
+        # runs of weak modes: a new run starts at every weak mode following a strong one
+        runs = np.cumsum(~weak | np.concatenate(([True], ~weak[:-1])))
+        groups = np.where(weak, -runs, np.arange(1, len(weak) + 1))
+        _, first, labels = np.unique(groups, return_index=True, return_inverse=True)
+        total = np.bincount(labels, weights)
+        merged = np.bincount(labels, weights*frequencies) / np.where(total > 0, total, 1)
+        merged = np.where(total > 0, merged, frequencies[first])
+        spread = np.sum(weights*np.abs(frequencies - merged[labels]))
+        keep = np.argsort(merged, kind='stable')
+        kept_frequencies = merged[keep]
+        # the sign of a coupling is a gauge choice (Z_j flips it), the merged couplings are positive
+        kept_couplings = np.sqrt(total[keep])
+        dropped = 0.
+    else:
+        raise ValueError('unknown compression mode {}'.format(mode))
+
+    report = dict(modes_before=len(frequencies), modes_after=len(kept_frequencies), dropped_weight=float(dropped),
+                  frequency_spread=float(spread), relative_weight_error=float(dropped / max(weights.sum(), 1e-300)))
+    return kept_frequencies, kept_couplings, report
+
+def correlation_function(frequencies, couplings, times):
+    # bath correlation function C(t) = sum_k g_k**2 exp(-i w_k t) on the time grid
+    return np.exp(-1j*np.outer(times, frequencies)) @ np.asarray(couplings)**2
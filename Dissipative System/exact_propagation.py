@@ -0,0 +1,115 @@
+import numpy as np
+import scipy.linalg as la
+
+from trotter import spin_bath_propagator
+
+# Exact reference dynamics of the spin-bath Hamiltonian simulated by evolution_operator (see
+# hamiltonians.spin_bath_terms), by Lanczos propagation of the statevector on its sparse matrix:
+# 2**n memory and one sparse product per Krylov vector, where dense exponentials stop at ~12 spins.
+
+def lanczos_step(hamiltonian, psi, dt, krylov_dim=30):
+    # exp(-i H dt) psi in the Krylov space of H and psi, and the estimate of its error
+    # beta_m |(exp(-i T dt))[m-1, 0]| (zero when the Krylov space is invariant)
+    norm = np.linalg.norm(psi)
+    basis = [psi / norm]
+    alpha, beta = [], []
+    for j in range(krylov_dim):
+        w = hamiltonian @ basis[j]
+        alpha.append(np.vdot(basis[j], w).real)
+        w = w - alpha[j]*basis[j] - (beta[j-1]*basis[j-1] if j > 0 else 0)
+        # full reorthogonalization, the Krylov spaces being small
+        w = w - np.array(basis).T @ (np.array(basis).conj() @ w)
+        beta.append(np.linalg.norm(w))
+        if beta[j] < 1e-12*max(1, abs(alpha[j])):
+            break
+        basis.append(w / beta[j])
+    m = len(alpha)
+    energies, vectors = la.eigh_tridiagonal(np.array(alpha), np.array(beta[:m-1]))
+    coefficients = vectors @ (np.exp(-1j*dt*energies) * vectors[0])
+    error = norm * beta[m-1] * abs(coefficients[-1]) if m == krylov_dim else 0.
+    return norm * (np.array(basis[:m]).T @ coefficients), error
+
+def krylov_propagate(hamiltonian, psi, times, tol=1e-10, krylov_dim=30, dt=None):
+    # Statevectors at the (increasing, non negative) times, by Lanczos steps of adaptive length: a step
+    # whose error estimate exceeds tol*dt/duration is retried with half the length, a step well below
+    # it lets the next one grow
+    # Yields (t, psi(t)) for every time of the grid
+    times = np.asarray(times, dtype=float)
+    duration = max(times[-1], 1e-300)
+    t = 0.
+    dt = dt or duration / max(len(times), 1)
+    for target in times:
+        while t < target:
+            step = min(dt, target - t)
+            candidate, error = lanczos_step(hamiltonian, psi, step, krylov_dim)
+            if error > tol*step/duration and step > 1e-12*duration:
+                dt = step/2
+                continue
+            psi, t = candidate, t + step
+            if error < 0.1*tol*step/duration and step == dt:
+                dt *= 1.5
+        yield t, psi
+
+def initial_state(n_spins, system_state=(0, 1), configuration=0):
+    # |bath configuration> (x) |system state>, the system being spin 0 (excited by default)
+    psi = np.zeros(2**n_spins, dtype=complex)
+    psi[configuration << 1] = system_state[0]
+    psi[(configuration << 1) | 1] = system_state[1]
+    return psi / np.linalg.norm(psi)
+
+def exact_z_dynamics(system_pulse, frequencies, couplings, times, psi=None, spin=0, tol=1e-10, krylov_dim=30):
+    # <Z_spin>(t) on the time grid, starting from psi (by default the excited system and the bath in |0...0>)
+    propagator = spin_bath_propagator(system_pulse, frequencies, couplings)
+    hamiltonian = propagator.matrix()
+    if psi is None:
+        psi = initial_state(propagator.n_spins)
+    return np.array([propagator.z_expectation(state, spin)
+                     for _, state in krylov_propagate(hamiltonian, psi, times, tol, krylov_dim)])
+
+def _trotter_error(propagator, exact, psi, n0, tau, order, spin):
+    trotter = [state for _, _, state in propagator.stream(psi, tau, len(exact), n0, order)]
+    z_exact = np.array([propagator.z_expectation(state, spin) for state in exact])
+    z_trotter = np.array([propagator.z_expectation(state, spin) for state in trotter])
+    return dict(times=tau*np.arange(1, len(exact) + 1), exact=z_exact, trotter=z_trotter,
+                z_error=np.max(np.abs(z_exact - z_trotter)),
+                state_error=max(np.linalg.norm(a - b) for a, b in zip(exact, trotter)))
+
+def _reference(system_pulse, frequencies, couplings, tau, n_steps, psi, tol):
+    # propagator, initial state and exact statevectors after every step tau
+    propagator = spin_bath_propagator(system_pulse, frequencies, couplings)
+    if psi is None:
+        psi = initial_state(propagator.n_spins)
+    times = tau*np.arange(1, n_steps + 1)
+    exact = [state for _, state in krylov_propagate(propagator.matrix(), psi, times, tol)]
+    return propagator, psi, exact
+
+def trotter_error(system_pulse, frequencies, couplings, n0, tau, n_steps, order=1, psi=None, spin=0, tol=1e-10):
+    # Error of the Trotter steps of evolution_operator(n0, tau, ...) (order 1, or the Suzuki steps of
+    # TrotterPropagator) over n_steps steps tau, against the exact propagation
+    # Returns dict of the times, the exact and Trotter <Z_spin>, their largest difference 'z_error' and the
+    # largest statevector distance 'state_error'
+    propagator, psi, exact = _reference(system_pulse, frequencies, couplings, tau, n_steps, psi, tol)
+    return _trotter_error(propagator, exact, psi, n0, tau, order, spin)
+
+def smallest_n0(system_pulse, frequencies, couplings, tau, n_steps, target, order=1, psi=None, spin=0,
+                max_n0=4096, error='z_error', tol=1e-10):
+    # Smallest number of Trotter steps per tau whose error (z_error or state_error, see trotter_error)
+    # meets target: doubling up to a sufficient n0, then bisection (the error decreasing with n0).
+    # The exact reference is propagated once.
+    propagator, psi, exact = _reference(system_pulse, frequencies, couplings, tau, n_steps, psi, tol)
+
+    def meets(n0):
+        return _trotter_error(propagator, exact, psi, n0, tau, order, spin)[error] <= target
+    high = 1
+    while not meets(high):
+        if high >= max_n0:
+            raise ValueError('target error not met with n0 = {}'.format(max_n0))
+        high = min(2*high, max_n0)
+    low = high // 2
+    while high - low > 1:
+        middle = (low + high) // 2
+        if meets(middle):
+            high = middle
+        else:
+            low = middle
+    return high
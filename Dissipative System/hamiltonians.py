@@ -1,7 +1,15 @@
-from qiskit.quantum_info import Pauli
-from qiskit.opflow		  import PauliOp, SummedOp
+from qiskit.quantum_info import Pauli, SparsePauliOp
+from qiskit.opflow		  import PauliOp, PauliSumOp, SummedOp
 import numpy as np
 
+def pauli_sum(xspins, zspins, coeffs):
+    # PauliSumOp built in one go from symplectic arrays (one row per term, spin j in column j)
+    xspins = np.asarray(xspins, dtype=bool)
+    zspins = np.asarray(zspins, dtype=bool)
+    chars = np.where(xspins & zspins, 'Y', np.where(xspins, 'X', np.where(zspins, 'Z', 'I')))
+    labels = [''.join(row[::-1]) for row in chars]
+    return PauliSumOp(SparsePauliOp.from_list(list(zip(labels, coeffs))))
+
 def open_system_hamiltonian(totspin):
     zspin = [0]*totspin
     xspin = [0]*totspin
@@ -10,39 +18,38 @@ def open_system_hamiltonian(totspin):
     xspin = np.asarray(xspin, dtype=bool)
     return PauliOp(Pauli((zspin,xspin)),-0.5)
 
+def environment_terms(frequencies):
+    # Z on each bath spin j = 1..len(frequencies), with coefficient frequencies[j-1]
+    env_spins = len(frequencies)
+    zspins = np.zeros((env_spins, env_spins+1), dtype=bool)
+    zspins[np.arange(env_spins), np.arange(1, env_spins+1)] = True
+    return np.zeros_like(zspins), zspins, np.asarray(frequencies, dtype=float)
+
 def environment_hamiltonian(frequencies):
-    totspin = len(frequencies)+1
-    paulis = []
-    for j in range(1,totspin):
-        zspin = [0] * totspin
-        xspin = [0] * totspin
-        zspin[j] = 1
-        zspin = np.asarray(zspin, dtype=bool)
-        xspin = np.asarray(xspin, dtype=bool)
-        paulis.append(Pauli((zspin,xspin)))
-    str = ''
-    for i in range(len(frequencies)+1):
-        str = str + 'I'
-    env_h = PauliOp(Pauli(str),0)
-    for j in range(totspin-1):
-        env_h = env_h + PauliOp(paulis[j],frequencies[j])
-    return env_h
+    return pauli_sum(*environment_terms(frequencies))
 
-def interaction_hamiltonian(couplings):
-    for k in range(len(couplings)):
-        couplings[k] = 0.5*couplings[k]
+def interaction_terms(couplings):
+    # X on the system spin 0 times X on bath spin j = 1..len(couplings), coefficient couplings[j-1]/2
     env_spins = len(couplings)
-    paulis = []
-    for j in range(env_spins):
-        zspin = [0] * env_spins
-        xspin = [0] * env_spins
-        xspin[j] = 1
-        zspin = np.asarray(zspin, dtype=bool)
-        xspin = np.asarray(xspin, dtype=bool)
-        paulis.append(Pauli((zspin,xspin)))
-    sum = PauliOp(paulis[0],couplings[0])
-    for j in range(1,env_spins):
-        sum = sum + PauliOp(paulis[j],couplings[j])
-    inter_h = PauliOp(Pauli('X'))
-    return inter_h.tensor(sum)
+    xspins = np.zeros((env_spins, env_spins+1), dtype=bool)
+    xspins[:, 0] = True
+    xspins[np.arange(env_spins), np.arange(1, env_spins+1)] = True
+    return xspins, np.zeros_like(xspins), 0.5*np.asarray(couplings, dtype=float)
+
+def interaction_hamiltonian(couplings):
+    return pauli_sum(*interaction_terms(couplings))
+
+def spin_bath_terms(system_pulse, frequencies, couplings):
+    # Terms of the Hamiltonian simulated by evolution_operator, spin 0 being the system:
+    #   -system_pulse/2 Z_0 - sum_j frequencies[j-1]/2 Z_j + sum_j couplings[j-1]/2 X_0 X_j
+    # (rz(-w*tau/n0) is exp(i*w*tau/n0*Z/2), the convention of spin_bath_equilibrium too,
+    # while environment_hamiltonian carries +frequencies[j-1] Z_j)
+    frequencies = np.asarray(frequencies, dtype=float)
+    env_x, env_z, env_coeffs = environment_terms(-0.5*np.concatenate(([system_pulse], frequencies)))
+    # environment_terms puts its first term on spin 1: shift the columns onto spins 0..len(frequencies)
+    env_x, env_z = env_x[:, 1:], env_z[:, 1:]
+    int_x, int_z, int_coeffs = interaction_terms(couplings)
+    return np.concatenate((env_x, int_x)), np.concatenate((env_z, int_z)), np.concatenate((env_coeffs, int_coeffs))
 
+def spin_bath_hamiltonian(system_pulse, frequencies, couplings):
+    return pauli_sum(*spin_bath_terms(system_pulse, frequencies, couplings))
@@ -12,4 +12,8 @@ def spin_bath_equilibrium(T,omegas):
     environment_density_matrix = qi.DensityMatrix(rho[0])
     for j in range(length-1):
         environment_density_matrix = environment_density_matrix.tensor(qi.DensityMatrix(rho[j+1]))
-    return environment_density_matrix
\ No newline at end of file
+    return environment_density_matrix
+
+def excitation_probabilities(T, omegas):
+    # probability of the excited state |1> of every bath mode, 1/(1+exp(w/T))
+    return 1/(1 + np.exp(np.asarray(omegas, dtype=float)/T))
@@ -0,0 +1,128 @@
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+from spin_bath_equilibrium import excitation_probabilities
+from trotter import spin_bath_propagator
+
+# The thermal bath state of spin_bath_equilibrium is a product of diagonal single-spin states, i.e. a
+# mixture of computational basis states of the bath. Instead of the 4**n density matrix of the whole
+# system, the basis states of the bath are propagated as pure states (2**n each, in batches) and their
+# <Z_0> averaged with their Boltzmann weights. Bath mode j-1 is spin j, as in evolution_operator.
+
+def configuration_weights(configurations, probabilities):
+    # Boltzmann weight of bath basis states, bit j-1 of a configuration being set if mode j is excited
+    bits = (np.asarray(configurations)[:, None] >> np.arange(len(probabilities))) & 1
+    return np.prod(np.where(bits, probabilities, 1 - probabilities), axis=1)
+
+def sample_configurations(probabilities, n_samples, rng):
+    # bath basis states drawn mode by mode with the excitation probabilities
+    bits = rng.random((n_samples, len(probabilities))) < probabilities
+    return bits @ (1 << np.arange(len(probabilities)))
+
+def _product_states(system_states, configurations, dim):
+    # columns |configuration> (x) |system state>, the system being spin 0
+    states = np.zeros((dim, len(configurations)), dtype=complex)
+    columns = np.arange(len(configurations))
+    states[configurations << 1, columns] = system_states[:, 0]
+    states[(configurations << 1) | 1, columns] = system_states[:, 1]
+    return states
+
+def _propagate(hamiltonian, system_state, configurations, weights, probabilities, proposal, reset,
+               tau, n_steps, n0, order, seed):
+    # <Z_0> after every step of a batch of bath configurations, and the importance weights of the samples
+    propagator = spin_bath_propagator(*hamiltonian)
+    rng = np.random.default_rng(seed)
+    n = len(configurations)
+    columns = np.arange(n)
+    states = _product_states(np.tile(system_state, (n, 1)), configurations, propagator.dim)
+    weights = np.array(weights, dtype=float)
+    z, w = np.zeros((n_steps, n)), np.zeros((n_steps, n))
+    for k in range(n_steps):
+        states = propagator.step(states, tau, n0, order)
+        z[k], w[k] = propagator.z_expectation(states), weights
+        if reset and k < n_steps - 1:
+            # trace the bath out by measuring it in the computational basis: the system is left in
+            # its state conditional on the outcome, then coupled to a fresh thermal bath
+            pairs = states.reshape(-1, 2, n)
+            marginal = np.sum(np.abs(pairs)**2, axis=1)
+            cumulative = np.cumsum(marginal, axis=0) / marginal.sum(axis=0)
+            outcomes = np.minimum(np.sum(cumulative < rng.random(n), axis=0), len(marginal) - 1)
+            system = pairs[outcomes, :, columns] / np.sqrt(marginal[outcomes, columns])[:, None]
+            fresh = sample_configurations(proposal, n, rng)
+            weights = weights * configuration_weights(fresh, probabilities) / configuration_weights(fresh, proposal)
+            states = _product_states(system, fresh, propagator.dim)
+    return z, w
+
+def _estimate(z, w):
+    # self-normalized importance sampling mean of every step and its standard error
+    total = w.sum(axis=1)
+    mean = np.sum(w*z, axis=1) / total
+    error = np.sqrt(np.sum(w**2 * (z - mean[:, None])**2, axis=1)) / total
+    return mean, error
+
+def thermal_z_dynamics(system_pulse, frequencies, couplings, temperature, tau, n_steps, n0=1, order=1,
+                       system_state=(0, 1), n_samples=None, reset=False, proposal_temperature=None,
+                       target_error=None, batch=64, workers=None, seed=None):
+    # <Z_0>(t) at t = tau, 2 tau, ..., n_steps tau, starting from system_state (amplitudes of |0> and |1>
+    # of the system spin, excited by default) and the thermal bath of spin_bath_equilibrium, propagated
+    # by TrotterPropagator steps (n0 Trotter steps of the given order per tau).
+    #   n_samples None: exact diagonal ensemble, all the 2**len(frequencies) bath basis states with their
+    #       Boltzmann weights, propagated in batches of batch states
+    #   otherwise: up to n_samples bath states sampled from the thermal probabilities at proposal_temperature
+    #       (importance sampling, temperature by default) in batches of batch samples, stopping as soon as
+    #       the standard error of every point is below target_error
+    #   reset: bath reset to equilibrium after every step, as in main.ipynb (sampled mode only), unraveled
+    #       into pure states by measuring the bath
+    #   workers: processes propagating the batches in parallel (None: in process)
+    # Returns (times, <Z_0>, standard error), the error being 0 for the exact ensemble
+    if n_samples is not None and n_samples < 1:
+        raise ValueError('n_samples must be at least 1, not {}'.format(n_samples))
+    probabilities = excitation_probabilities(temperature, frequencies)
+    proposal = excitation_probabilities(proposal_temperature or temperature, frequencies)
+    n_modes = len(probabilities)
+    hamiltonian = (system_pulse, frequencies, couplings)
+    system_state = np.asarray(system_state, dtype=complex) / np.linalg.norm(system_state)
+    sequence = np.random.SeedSequence(seed)
+
+    if n_samples is None:
+        if reset:
+            raise ValueError('the bath reset is only available with sampled bath states (n_samples)')
+        configurations = np.arange(2**n_modes)
+        rounds = [[(chunk, configuration_weights(chunk, probabilities))
+                   for chunk in np.array_split(configurations, max(1, -(-len(configurations) // batch)))]]
+    else:
+        rng = np.random.default_rng(sequence.spawn(1)[0])
+        sizes = [min(batch, n_samples - start) for start in range(0, n_samples, batch)]
+        chunks = [sample_configurations(proposal, size, rng) for size in sizes]
+        chunks = [(chunk, configuration_weights(chunk, probabilities) / configuration_weights(chunk, proposal))
+                  for chunk in chunks]
+        # one chunk per worker between two checks of the target error
+        per_round = workers or 1
+        rounds = [chunks[start:start + per_round] for start in range(0, len(chunks), per_round)]
+
+    def arguments(chunk, weights, chunk_seed):
+        return (hamiltonian, system_state, chunk, weights, probabilities, proposal, reset, tau, n_steps, n0, order,
+                chunk_seed)
+
+    executor = ProcessPoolExecutor(workers) if workers else None
+    z, w = np.zeros((n_steps, 0)), np.zeros((n_steps, 0))
+    try:
+        for chunks in rounds:
+            seeds = sequence.spawn(len(chunks))
+            if executor is None:
+                results = [_propagate(*arguments(chunk, weights, s)) for (chunk, weights), s in zip(chunks, seeds)]
+            else:
+                results = list(executor.map(_propagate, *zip(*[arguments(chunk, weights, s)
+                                                              for (chunk, weights), s in zip(chunks, seeds)])))
+            z = np.concatenate([z] + [r[0] for r in results], axis=1)
+            w = np.concatenate([w] + [r[1] for r in results], axis=1)
+            mean, error = _estimate(z, w)
+            if target_error is not None and n_samples is not None and np.max(error) < target_error:
+                break
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    if n_samples is None:
+        error = np.zeros(n_steps)
+    return tau*np.arange(1, n_steps + 1), mean, error
@@ -0,0 +1,132 @@
+import os
+import sys
+import numpy as np
+import scipy.sparse as sp
+
+from hamiltonians import spin_bath_terms
+
+# pauli_table is at the root of the repository
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from pauli_table import bit_parity
+
+# Suzuki's fourth order recursion S4(dt) = S2(p dt)^2 S2((1-4p) dt) S2(p dt)^2
+_SUZUKI_P = 1 / (4 - 4**(1/3))
+
+# time steps whose factors are kept: the 4 sub-steps of a Suzuki step, for the current and the previous step size
+_MAX_CACHED_STEPS = 8
+
+class TrotterPropagator:
+    # Trotter propagation of pure states or density matrices under a sum of Pauli strings, given as
+    # symplectic term arrays (spin j = column j = bit j of the basis index, as in hamiltonians.py).
+    # The diagonal terms (Z strings) are applied together as one phase vector; every other term P
+    # as cos(c dt) - i sin(c dt) P, P being a bit flip permutation times a phase vector computed once.
+    # The factors of a given time step are computed at its first use and then reused (for the last
+    # _MAX_CACHED_STEPS time steps).
+    # Order 1 applies the diagonal layer, then the other terms: the step of evolution_operator.
+    # Orders 2 and 4 are the symmetric Strang and Suzuki steps.
+    def __init__(self, xspins, zspins, coeffs):
+        xspins = np.atleast_2d(np.asarray(xspins, dtype=bool))
+        zspins = np.atleast_2d(np.asarray(zspins, dtype=bool))
+        coeffs = np.asarray(coeffs, dtype=float)
+        self.n_spins = xspins.shape[1]
+        self.dim = 2**self.n_spins
+        powers = 1 << np.arange(self.n_spins)
+        xmasks, zmasks = xspins @ powers, zspins @ powers
+        index = np.arange(self.dim)
+
+        diagonal = xmasks == 0
+        self.energies = (1 - 2*bit_parity(index[None, :], zmasks[diagonal, None])).T @ coeffs[diagonal]
+        # P|k> for the other terms: (P psi)[k] = i^(number of Y) (-1)^parity((k^x) & z) psi[k^x]
+        self.flips = []
+        for x, z, c, n_y in zip(xmasks[~diagonal], zmasks[~diagonal], coeffs[~diagonal],
+                                (xspins & zspins)[~diagonal].sum(axis=1)):
+            perm = index ^ x
+            phase = 1j**n_y * (1 - 2*bit_parity(perm, z))
+            self.flips.append((c, perm, phase))
+
+        # the off diagonal terms commute (e.g. the X_0 X_j couplings): no splitting among them
+        x, z = xspins[~diagonal].astype(int), zspins[~diagonal].astype(int)
+        self.commuting = not np.any((x @ z.T + z @ x.T) % 2)
+        self._factors = {}
+
+    def matrix(self):
+        # sparse matrix of the Hamiltonian, H[k, k^x] = c * phase[k] for every term
+        dim = self.dim
+        rows = [np.arange(dim)] + [np.arange(dim) for _ in self.flips]
+        cols = [np.arange(dim)] + [perm for _, perm, _ in self.flips]
+        data = [self.energies.astype(complex)] + [c*phase for c, _, phase in self.flips]
+        return sp.csr_matrix((np.concatenate(data), (np.concatenate(rows), np.concatenate(cols))), shape=(dim, dim))
+
+    def _layer_factors(self, dt):
+        if dt not in self._factors:
+            if len(self._factors) >= _MAX_CACHED_STEPS:
+                del self._factors[next(iter(self._factors))]
+            self._factors[dt] = (np.exp(-1j*dt*self.energies),
+                                 [(np.cos(c*dt), -1j*np.sin(c*dt)*phase, perm) for c, perm, phase in self.flips])
+        return self._factors[dt]
+
+    @staticmethod
+    def _column(vector, state):
+        return vector.reshape((-1,) + (1,)*(state.ndim - 1))
+
+    def _diagonal(self, state, dt):
+        return self._column(self._layer_factors(dt)[0], state)*state
+
+    def _flip(self, state, dt, k):
+        cos, sin_phase, perm = self._layer_factors(dt)[1][k]
+        return cos*state + self._column(sin_phase, state)*state[perm]
+
+    def _off_diagonal(self, state, dt, symmetric):
+        # the last term gets the full step, the others half steps on both sides when they do not commute
+        n = len(self.flips)
+        if self.commuting or not symmetric:
+            for k in range(n):
+                state = self._flip(state, dt, k)
+            return state
+        for k in range(n - 1):
+            state = self._flip(state, dt/2, k)
+        state = self._flip(state, dt, n - 1)
+        for k in reversed(range(n - 1)):
+            state = self._flip(state, dt/2, k)
+        return state
+
+    def _apply(self, state, dt, order):
+        # U(dt) applied to the state vectors along the first axis
+        if order == 1:
+            return self._off_diagonal(self._diagonal(state, dt), dt, False)
+        if order == 2:
+            state = self._diagonal(state, dt/2)
+            state = self._off_diagonal(state, dt, True)
+            return self._diagonal(state, dt/2)
+        if order == 4:
+            for fraction in (_SUZUKI_P, _SUZUKI_P, 1 - 4*_SUZUKI_P, _SUZUKI_P, _SUZUKI_P):
+                state = self._apply(state, fraction*dt, 2)
+            return state
+        raise ValueError('Trotter order must be 1, 2 or 4, not {}'.format(order))
+
+    def step(self, state, dt, n0=1, order=1, density=False):
+        # Evolves state by time dt in n0 Trotter steps of dt/n0: a statevector (or 2**n x k array of
+        # statevectors), or a density matrix if density
+        for _ in range(n0):
+            state = self._apply(state, dt/n0, order)
+            if density:
+                state = self._apply(state.conj().T, dt/n0, order).conj().T
+        return state
+
+    def z_expectation(self, state, spin=0, density=False):
+        # <Z_spin> of the state (one value per column for an array of statevectors)
+        signs = 1 - 2*((np.arange(self.dim) >> spin) & 1)
+        if density:
+            return np.real(np.diagonal(state) @ signs)
+        return signs @ np.abs(state)**2
+
+    def stream(self, state, tau, n_steps, n0=1, order=1, spin=0, density=False):
+        # Yields (t, <Z_spin>(t), state) after each of the n_steps time steps tau (of n0 Trotter steps
+        # each), carrying the state on instead of restarting from t=0
+        for k in range(1, n_steps + 1):
+            state = self.step(state, tau, n0, order, density)
+            yield k*tau, self.z_expectation(state, spin, density), state
+
+def spin_bath_propagator(system_pulse, frequencies, couplings):
+    # Propagator of the Hamiltonian of evolution_operator(n0, tau, system_pulse, frequencies, couplings)
+    return TrotterPropagator(*spin_bath_terms(system_pulse, frequencies, couplings))
@@ -6,6 +6,8 @@ from qiskit.quantum_info 			  import Pauli
 # from qiskit.aqua.operators 			  import PauliOp, SummedOp
 from qiskit.opflow		  import PauliOp, SummedOp
 
+from pauli_table import PauliTable
+
 def generate_pauli(idx_x,idx_z,n):
 
 	'''
@@ -29,7 +31,7 @@ def generate_pauli(idx_x,idx_z,n):
 
 
 
-def generate_XYZ(J_x,J_y,J_z,field,n_spins=3, pbc=True):
+def generate_XYZ_table(J_x,J_y,J_z,field,n_spins=3, pbc=True):
 	'''
 	Args:
 		n_spins (integer)
@@ -38,47 +40,41 @@ def generate_XYZ(J_x,J_y,J_z,field,n_spins=3, pbc=True):
 		pbc: periodic boundary condition
 
 	Returns:
-		Hamiltonian of XYZ model with XX, YY, ZZ interactions and a  Z transverse field
+		PauliTable of the XYZ model with XX, YY, ZZ interactions and a Z transverse field,
+		built in bulk
 	'''
-	int_x_list = []
-	int_y_list = []
-	int_z_list = []
-	field_list = []
-
+	bonds = [(i,i+1) for i in range(n_spins-1)]
 	if pbc:
-		int_z_list.append(generate_pauli([],[0,n_spins-1],n_spins))
-		int_x_list.append(generate_pauli([0,n_spins-1],[],n_spins))
-		int_y_list.append(generate_pauli([0,n_spins-1],[0,n_spins-1],n_spins))
-
+		bonds = [(0,n_spins-1)] + bonds
+	first, second = np.array(bonds,dtype=int).reshape(-1,2).T
+	n_bonds = len(bonds)
+	bond_rows = np.arange(n_bonds)
+	field_rows = 3*n_bonds + np.arange(n_spins)
 
-	for i in range(n_spins-1):
-		int_z_list.append(generate_pauli([],[i,i+1],n_spins))
-	for i in range(n_spins-1):
-		int_x_list.append(generate_pauli([i,i+1],[],n_spins))
-	for i in range(n_spins-1):
-		int_y_list.append(generate_pauli([i,i+1],[i,i+1],n_spins))
+	x = np.zeros((3*n_bonds+n_spins,n_spins),dtype=bool)
+	z = np.zeros((3*n_bonds+n_spins,n_spins),dtype=bool)
+	# XX, YY and ZZ interactions, then the field
+	for rows, is_x, is_z in ((bond_rows,True,False),(n_bonds+bond_rows,True,True),(2*n_bonds+bond_rows,False,True)):
+		x[rows,first] = x[rows,second] = is_x
+		z[rows,first] = z[rows,second] = is_z
+	z[field_rows,np.arange(n_spins)] = True
 
-	for i in range(n_spins):
-		field_list.append(generate_pauli([],[i],n_spins))
+	coeffs = np.repeat([J_x,J_y,J_z,field],[n_bonds,n_bonds,n_bonds,n_spins])
+	return -0.5*PauliTable(x,z,coeffs)
 
-	int_x_coeff = [J_x]*len(int_x_list)
-	int_y_coeff = [J_x]*len(int_y_list)
-	int_z_coeff = [J_x]*len(int_z_list)
-	field_coeff = [field]*len(field_list)
 
+def generate_XYZ(J_x,J_y,J_z,field,n_spins=3, pbc=True):
+	'''
+	Args:
+		n_spins (integer)
+		J_x, J_y, J_z: coeff of the spin-spin interaction
+		h: h field   (float)
+		pbc: periodic boundary condition
 
-	H = PauliOp(int_x_list[0],int_x_coeff[0])
-
-	for i in range(1,len(int_x_list)):
-		H = H + PauliOp(int_x_list[i],int_x_coeff[i])
-	for i in range(0,len(int_y_list)):
-		H = H + PauliOp(int_y_list[i],int_y_coeff[i])
-	for i in range(0,len(int_z_list)):
-		H = H + PauliOp(int_z_list[i],int_z_coeff[i])
-
-	for i in range(len(field_list)):
-		H = H + PauliOp(field_list[i],field_coeff[i])
-	return -0.5*H
+	Returns:
+		Hamiltonian of XYZ model with XX, YY, ZZ interactions and a  Z transverse field
+	'''
+	return generate_XYZ_table(J_x,J_y,J_z,field,n_spins,pbc).to_pauli_sum_op()
 
 
 def main():
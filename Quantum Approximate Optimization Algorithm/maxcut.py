@@ -0,0 +1,138 @@
+import random as rand
+import numpy as np
+from qiskit import QuantumCircuit, execute, Aer
+
+# MaxCut cost engine of the QAOA notebooks. Measurement counts are encoded once as integer arrays
+# (bit i of an outcome being node i, i.e. qubit/classical bit i, the rightmost character of the
+# qiskit bitstring) and the cut values of all the outcomes are evaluated together from the edge
+# arrays with bit operations.
+
+def edge_arrays(G):
+    # (first nodes, second nodes, weights) of the edges of a networkx graph (weight 1 by default),
+    # or of a list of (i, j) or (i, j, weight) edges
+    if hasattr(G, 'edges'):
+        edges = [(i, j, w) for i, j, w in G.edges(data='weight', default=1.0)]
+    else:
+        edges = [tuple(edge) + (1.0,)*(3 - len(edge)) for edge in G]
+    first, second, weights = zip(*edges) if edges else ((), (), ())
+    return np.array(first, dtype=np.int64), np.array(second, dtype=np.int64), np.array(weights, dtype=float)
+
+def encode_counts(counts):
+    # Outcomes of qiskit counts as integers (qubit 0 rightmost) and their numbers of occurrences
+    keys = [key.replace(' ', '') for key in counts]
+    if not keys:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    n_bits = len(keys[0])
+    if n_bits > 63:
+        raise ValueError('outcomes of more than 63 bits do not fit in integer arrays')
+    bits = np.frombuffer(''.join(keys).encode(), dtype=np.uint8).reshape(len(keys), n_bits) - ord('0')
+    outcomes = bits.astype(np.int64) @ (1 << np.arange(n_bits - 1, -1, -1, dtype=np.int64))
+    return outcomes, np.fromiter(counts.values(), dtype=np.int64, count=len(keys))
+
+def cut_values(outcomes, edges):
+    # Cut value sum_(i,j) w_ij [x_i != x_j] of every outcome (integer array), edges from edge_arrays
+    first, second, weights = edges
+    outcomes = np.asarray(outcomes, dtype=np.int64)[:, None]
+    return (((outcomes >> first) ^ (outcomes >> second)) & 1) @ weights
+
+def cost_function_C(x, G):
+    # Cut value of the node assignments x (x[i] in {0, 1} for node i), one assignment or one per row
+    x = np.asarray(x, dtype=np.int64)
+    if x.shape[-1] != len(G.nodes()):
+        return np.nan
+    first, second, weights = edge_arrays(G)
+    return (x[..., first] ^ x[..., second]) @ weights
+
+def cut_statistics(counts, G):
+    # Statistics of the cuts of qiskit counts on graph G, in one pass over the distinct outcomes:
+    #   mean: average cut value of the shots
+    #   max: largest cut value sampled, best: its bitstring (first one in counts), best_probability: its frequency
+    #   values, probabilities: distribution of the cut values
+    outcomes, occurrences = encode_counts(counts)
+    if len(outcomes) == 0:
+        raise ValueError('no outcome in the counts')
+    cuts = cut_values(outcomes, edge_arrays(G))
+    shots = occurrences.sum()
+    values, inverse = np.unique(cuts, return_inverse=True)
+    best = int(np.argmax(cuts))
+    return dict(mean=float(occurrences @ cuts / shots), max=float(cuts[best]), best=list(counts)[best],
+                best_probability=float(occurrences[best] / shots), values=values,
+                probabilities=np.bincount(inverse, occurrences) / shots)
+
+def default_graph():
+    # graph of the 7 nodes and 11 edges of QAOA_Graph_Production, used by computation when no graph is given
+    import networkx as nx
+
+    G = nx.Graph()
+    G.add_nodes_from(np.arange(0, 7, 1))
+    G.add_weighted_edges_from([(0, 1, 1.0), (0, 2, 1.0), (1, 2, 1.0), (3, 2, 1.0), (3, 4, 1.0), (4, 2, 1.0), (2, 6, 1.0),
+                               (5, 3, 1.0), (0, 4, 1.0), (5, 6, 1.0), (1, 6, 1.0)])
+    return G
+
+def phase_flip(Circuit, probability=0.05):
+    # Z gate on every qubit with the given probability
+    for i in range(Circuit.num_qubits):
+        if rand.uniform(0, 1) < probability:
+            Circuit.z(i)
+
+def bit_flip(Circuit, probability=0.05):
+    # X gate on every qubit with the given probability
+    for i in range(Circuit.num_qubits):
+        if rand.uniform(0, 1) < probability:
+            Circuit.x(i)
+
+def depolarizing_noise(Circuit, probability=0.05):
+    # X, Y or Z gate on every qubit, each with probability/3
+    for i in range(Circuit.num_qubits):
+        p = rand.uniform(0, 1)
+        if p < probability/3.:
+            Circuit.x(i)
+        elif p < 2*probability/3.:
+            Circuit.y(i)
+        elif p < probability:
+            Circuit.z(i)
+
+def QAOA_circuit(γ, β, G, prob=None):
+    # p blocks (length of γ, β) of the evolution by the cost Hamiltonian of G and by the X mixer,
+    # measured in the computational basis (qubit i in classical bit i). With prob = [phase flip,
+    # depolarizing, bit flip] probabilities, the channels are drawn after every edge of the cost layer
+    n = len(G.nodes())
+    QAOA = QuantumCircuit(n, n)
+    QAOA.h(range(n))
+    QAOA.barrier()
+    for i in range(len(γ)):
+        for k, l in G.edges():
+            QAOA.cp(2*γ[i], int(k), int(l))
+            QAOA.p(-γ[i], int(k))
+            QAOA.p(-γ[i], int(l))
+            if prob is not None:
+                phase_flip(QAOA, prob[0])
+                depolarizing_noise(QAOA, prob[1])
+                bit_flip(QAOA, prob[2])
+        QAOA.barrier()
+        QAOA.rx(-2*β[i], range(n))
+    QAOA.barrier()
+    QAOA.measure(range(n), range(n))
+    return QAOA
+
+def QAOA_noisy_local_model(γ, β, G, prob=(0., 0., 0.)):
+    # QAOA_circuit with the phase flip, depolarizing and bit flip channels of probabilities prob
+    return QAOA_circuit(γ, β, G, prob)
+
+def best_string(angles, G, prob=(0., 0., 0.), backend_1=None, shots_1=10000, noise=False):
+    # Average cut value, [best bitstring, its cut value, its frequency] and counts of the QAOA state of
+    # angles (γ_1, β_1, γ_2, β_2, ...) sampled on backend_1 (Aer qasm_simulator by default), with the noise
+    # channels of QAOA_noisy_local_model if noise, as best_string of the notebooks
+    backend_1 = backend_1 or Aer.get_backend("qasm_simulator")
+    γ, β = angles[0::2], angles[1::2]
+    circuit = QAOA_noisy_local_model(γ, β, G, prob) if noise else QAOA_circuit(γ, β, G)
+    counts = execute(circuit, backend=backend_1, shots=shots_1).result().get_counts()
+    statistics = cut_statistics(counts, G)
+    return statistics['mean'], [statistics['best'], statistics['max'], statistics['best_probability']], counts
+
+def computation(angles, G=None, backend_1=None, shots_1=10000, prob=(0., 0., 0.)):
+    # Objective of the angle optimization: minus the average cut value of QAOA_noisy_local_model on G
+    # (default_graph if None), as computation of the notebooks
+    if G is None:
+        G = default_graph()
+    return -best_string(angles, G, prob, backend_1, shots_1, noise=True)[0]
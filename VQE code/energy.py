@@ -1,29 +1,70 @@
+import os
+import sys
 import qiskit
 import numpy as np
+from collections import OrderedDict
 
+from qiskit.circuit                    import ParameterVector
 from qiskit.opflow.state_fns           import CircuitStateFn, StateFn
 from qiskit.opflow.expectations        import PauliExpectation
 from qiskit.opflow.converters          import CircuitSampler
 
-def energy(n_qubits, n_layer, op, ansatz, params, shots, instance):
-    # Make the operator measurable
-    op = StateFn(op, is_measurement=True)
+# the algorithms package is at the root of the repository
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from algorithms.profiling import profiler, circuit_count, count_sampled
+
+class TemplateCache:
+    # Small LRU cache of the templates built from some objects (op, instance, references...): an entry
+    # is found by the identity of these objects and holds them, so that their ids cannot be reused while
+    # it is cached. Beyond maxsize entries, the least recently used one is dropped with its objects.
+    def __init__(self, maxsize=8):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+
+    def get(self, objects, values, build):
+        # template of the objects (compared by identity) and the hashable values, built by build() at the first call
+        key = (tuple(id(o) for o in objects), values)
+        if key in self.entries:
+            self.entries.move_to_end(key)
+        else:
+            self.entries[key] = (objects, build())
+            if len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+        return self.entries[key][1]
 
-    # create the wavefunction
-    wfn = CircuitStateFn(ansatz(parameter=params, n_spins=n_qubits, n_layer=n_layer, full_rotation=True))
-    opwfn = op @ wfn  # matrix product
+# (theta, expectation, sampler) per configuration, see sampled_expectation
+_templates = TemplateCache()
+
+def sampled_expectation(n_qubits, n_layer, op, ansatz, n_params, instance):
+    # Measurable expectation of op on the ansatz built on a ParameterVector, and the sampler
+    # evaluating it. Both are cached, so the circuit is built and transpiled only once:
+    # every evaluation afterwards just binds the parameters.
+    def build():
+        with profiler.timer('circuit.construction'):
+            theta = ParameterVector('θ', n_params)
+            wfn = CircuitStateFn(ansatz(parameter=theta, n_spins=n_qubits, n_layer=n_layer, full_rotation=True))
+        with profiler.timer('opflow.conversion'):
+            expectation = PauliExpectation().convert(StateFn(op, is_measurement=True) @ wfn)
+        return theta, expectation, CircuitSampler(instance)
+    return _templates.get((op, ansatz, instance), (n_qubits, n_layer, n_params), build)
+
+def energy(n_qubits, n_layer, op, ansatz, params, shots, instance):
+    theta, expectation, sampler = sampled_expectation(n_qubits, n_layer, op, ansatz, len(params), instance)
 
-    # Simulate the sampling
-    grouped = PauliExpectation().convert(opwfn)
-    sampled_op = CircuitSampler(instance).convert(grouped)
+    # Simulate the sampling (transpiled by the sampler at its first call)
+    profiler.count('energy.evaluations')
+    count_sampled(instance, circuit_count(expectation))
+    with profiler.timer('sampling'):
+        sampled_op = sampler.convert(expectation, params=dict(zip(theta, params)))
 
     # Expectation value
-    mean_value = sampled_op.eval().real
-    est_err = 0
+    with profiler.timer('opflow.evaluation'):
+        mean_value = sampled_op.eval().real
+        est_err = 0
 
-    # If the simulations is not unitary evolution, return an error bar
-    if (not instance.is_statevector):
-        variance = PauliExpectation().compute_variance(sampled_op).real
-        est_err = np.sqrt(variance / shots)
+        # If the simulations is not unitary evolution, return an error bar
+        if (not instance.is_statevector):
+            variance = PauliExpectation().compute_variance(sampled_op).real
+            est_err = np.sqrt(variance / shots)
 
-    return mean_value, est_err
\ No newline at end of file
+    return mean_value, est_err
@@ -1,6 +1,10 @@
-from qiskit.opflow.state_fns           import CircuitStateFn, StateFn
+import os
+import sys
 from qiskit.opflow.expectations        import PauliExpectation
-from qiskit.opflow.converters          import CircuitSampler
+from energy import sampled_expectation
+# the algorithms package is at the root of the repository
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from algorithms.profiling import profiler, circuit_count, count_sampled
 import numpy as np
 
 def ei(i, n):
@@ -9,36 +13,39 @@ def ei(i, n):
     return vi[:]
 
 
-def gradient(n_qubits, n_layer, op, ansatz, params, shots, instance):
+def gradient(n_qubits, n_layer, op, ansatz, params, shots, instance, pool=None):
+    # pool: optional EvaluationPool of shift_objective (see parallel.py) spreading the shifted circuits over worker processes
     n_params = len(params)
-    wfn_circuits = []
-    op = StateFn(op, is_measurement=True)
 
-    for i in range(n_params):
-        wfn_circuits.append(CircuitStateFn(
-            ansatz(params + ei(i, n_params) * np.pi / 2.0, n_spins=n_qubits, n_layer=n_layer, full_rotation=True)))
-        wfn_circuits.append(CircuitStateFn(
-            ansatz(params - ei(i, n_params) * np.pi / 2.0, n_spins=n_qubits, n_layer=n_layer, full_rotation=True)))
-
-    # Now measure circuits
-    results = []
-    for wfn in wfn_circuits:
-        braket = op @ wfn
-
-        # Simulate the sampling
-        grouped = PauliExpectation().convert(braket)
-        sampled_op = CircuitSampler(instance).convert(grouped)
-
-        # Expectation value
-        mean_value = sampled_op.eval().real
-        est_err = 0
-
-        # If the simulations is not unitary evolution, return an error bar
-        if (not instance.is_statevector):
-            variance = PauliExpectation().compute_variance(sampled_op).real
-            est_err = np.sqrt(variance / shots)
-
-        results.append([mean_value, est_err])
+    # Shifted parameter sets: rows 2i and 2i+1 are params +/- pi/2 e_i
+    shifts = np.zeros((2 * n_params, n_params))
+    shifts[0::2] = np.eye(n_params) * np.pi / 2.0
+    shifts[1::2] = -np.eye(n_params) * np.pi / 2.0
+    param_sets = params + shifts
+
+    profiler.count('gradient.evaluations', len(param_sets))
+    if pool is not None:
+        with profiler.timer('pool.evaluation'):
+            results = pool(param_sets)
+        mean_values, variances = results[:, 0], results[:, -1]
+    else:
+        # Now measure circuits, all the bindings of the template in a single call
+        theta, expectation, sampler = sampled_expectation(n_qubits, n_layer, op, ansatz, n_params, instance)
+        count_sampled(instance, circuit_count(expectation) * len(param_sets))
+        with profiler.timer('sampling'):
+            sampled_op = sampler.convert(expectation, params={p: param_sets[:, k].tolist() for k, p in enumerate(theta)})
+
+        # Expectation values
+        with profiler.timer('opflow.evaluation'):
+            mean_values = np.real(sampled_op.eval())
+            variances = np.zeros(2 * n_params)
+
+            # If the simulations is not unitary evolution, return an error bar
+            if (not instance.is_statevector):
+                variances = np.real(PauliExpectation().compute_variance(sampled_op))
+    est_errs = np.sqrt(variances / shots)
+
+    results = np.stack((mean_values, est_errs), axis=1)
 
     g = np.zeros((n_params, 2))
     for i in range(n_params):
@@ -48,4 +55,4 @@ def gradient(n_qubits, n_layer, op, ansatz, params, shots, instance):
         # var(G) = var(Ep) * (dG/dEp)**2 + var(Em) * (dG/dEm)**2
         g[i, :] = (rplus[0] - rminus[0]) / 2.0, np.sqrt(rplus[1] ** 2 + rminus[1] ** 2) / 2.0
 
-    return g
\ No newline at end of file
+    return g
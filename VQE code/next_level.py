@@ -1,25 +1,48 @@
 from energy import *
 from gradient import *
 from overlap import *
+from qiskit.opflow import ListOp
 import numpy as np
 
-def next_level(n_qubits,n_layer,op,ansatz,parameters,shots,instance, lr, n_reps):
+# (theta, ListOp, sampler) per level, see penalized_expectation
+_penalized = TemplateCache()
+
+def penalized_expectation(n_qubits, n_layer, op, ansatz, references, n_params, instance):
+    # ListOp of the energy and of the overlaps with every reference, all on the same ansatz
+    # template, and the sampler evaluating them together. Cached per set of references.
+    theta, energy_expectation, _ = sampled_expectation(n_qubits, n_layer, op, ansatz, n_params, instance)
+
+    def build():
+        overlaps = [overlap_expectation(ansatz, ref, theta, n_qubits, n_layer) for ref in references]
+        return theta, ListOp([energy_expectation] + overlaps), CircuitSampler(instance)
+    return _penalized.get((theta, instance), tuple(np.asarray(ref).tobytes() for ref in references), build)
+
+def penalized_cost(n_qubits, n_layer, op, ansatz, references, params, instance, a, pool=None):
+    # Energy + a * sum of the overlaps and its gradient. The penalty is differentiated with the
+    # same parameter-shift rule as the energy, and the 2*length+1 parameter sets are bound to the
+    # energy and overlap circuits in a single sampler call, or spread over the workers of pool.
+    length = len(params)
+    param_sets = params + np.concatenate((np.zeros((1, length)),
+                                          np.eye(length) * np.pi / 2.0,
+                                          -np.eye(length) * np.pi / 2.0))
+    if pool is not None:
+        values = pool(param_sets, [np.asarray(ref) for ref in references])[:, :-1]
+    else:
+        theta, expectation, sampler = penalized_expectation(n_qubits, n_layer, op, ansatz, references, length, instance)
+        sampled_op = sampler.convert(expectation, params={p: param_sets[:, k].tolist() for k, p in enumerate(theta)})
+        values = np.real(np.array(sampled_op.eval()))
+    values = values[:, 0] + a*np.sum(values[:, 1:], axis=1)
+    return values[0], (values[1:length + 1] - values[length + 1:]) / 2.0
+
+def next_level(n_qubits,n_layer,op,ansatz,parameters,shots,instance, lr, n_reps, pool=None):
     curr_params = parameters[:][-1]
     a = 15
-    delta = 0.01
     length = len(parameters[0])
     level = len(parameters)
     a = a * level
     for i in range(n_reps):
-        nrj = energy(n_qubits,n_layer,op,ansatz,curr_params,shots,instance)
-        cost = nrj[0]
-        for lev in range(level):
-            cost = cost + a*overlap(ansatz,parameters[:][lev],curr_params,instance,n_qubits,n_layer)
-        grad = gradient(n_qubits, n_layer, op, ansatz, curr_params, shots, instance)
-        for j in range(length):
-            for lev in range(level):
-                grad[j,0] = grad[j,0] + a/2/delta*(overlap(ansatz,parameters[:][lev],curr_params + delta*ei(j,length),instance,n_qubits,n_layer) - overlap(ansatz,parameters[:][lev],curr_params - delta*ei(j,length),instance,n_qubits,n_layer))
-        curr_params = curr_params - lr*grad[:, 0]
+        cost, grad = penalized_cost(n_qubits, n_layer, op, ansatz, parameters[:level], curr_params, instance, a, pool)
+        curr_params = curr_params - lr*grad
         if i % 10 == 0:
             print('Run number: ', i + 1)
             print('Energy:', cost)
@@ -12,12 +12,16 @@ def projector_zero(n_qubits):
     prj = prj/np.power(2,n_qubits)
     return prj
 
-def overlap(ansatz,param0,paramf,instance,n_qubits, n_layer):
+def overlap_expectation(ansatz,param0,paramf,n_qubits,n_layer):
+    # measurable |<psi(paramf)|psi(param0)>|^2, paramf may be symbolic (ParameterVector)
     zero_proj = StateFn(projector_zero(n_qubits),is_measurement=True)
     ground_state_circuit = ansatz(param0,n_qubits,n_layer)
     excited_state_circuit = ansatz(paramf,n_qubits,n_layer)
     state_wfn = zero_proj @ StateFn(ground_state_circuit + excited_state_circuit.inverse())
-    grouped = PauliExpectation().convert(state_wfn)
+    return PauliExpectation().convert(state_wfn)
+
+def overlap(ansatz,param0,paramf,instance,n_qubits, n_layer):
+    grouped = overlap_expectation(ansatz,param0,paramf,n_qubits,n_layer)
     sampled_op = CircuitSampler(instance).convert(grouped)
     overl = sampled_op.eval().real
-    return overl
\ No newline at end of file
+    return overl
@@ -0,0 +1,38 @@
+import os
+import sys
+import numpy as np
+
+from qiskit import Aer
+from qiskit.opflow.expectations import PauliExpectation
+from qiskit.utils import QuantumInstance
+
+from next_level import penalized_expectation
+
+# the algorithms package is at the root of the repository
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from algorithms.parallel import EvaluationPool
+
+def shift_objective(n_qubits, n_layer, op, ansatz, backend, shots):
+    # Factory of an EvaluationPool (algorithms/parallel.py) evaluating the shifted parameter sets of
+    # gradient and next_level: every worker holds the ansatz template and the Hamiltonian on its own
+    # Aer backend, built once by penalized_expectation (and per set of references), so that only the
+    # parameter vectors are sent to the workers. Each parameter set is sampled with its own seed, so
+    # the results do not depend on the number of workers.
+    #   pool = EvaluationPool(shift_objective, (n_qubits, n_layer, op, ansatz, 'qasm_simulator', shots), workers, seed)
+    instance = QuantumInstance(Aer.get_backend(backend), shots=shots)
+
+    def objective(param_sets, seeds, references=()):
+        # rows of the energy, the overlaps with the references and the energy variance of every parameter set
+        theta, expectation, sampler = penalized_expectation(n_qubits, n_layer, op, ansatz, list(references),
+                                                            param_sets.shape[1], instance)
+        results = []
+        for row, seed in zip(param_sets, seeds):
+            instance.set_config(seed_simulator=int(seed))
+            binding = sampler.convert(expectation, params={p: [row[k]] for k, p in enumerate(theta)}).oplist[0]
+            variance = 0.
+            if (not instance.is_statevector):
+                variance = np.real(PauliExpectation().compute_variance(binding.oplist[0]))
+            results.append(np.append(np.real(np.array(binding.eval())), variance))
+        return np.array(results)
+
+    return objective
@@ -1,7 +1,12 @@
 from energy import *
 from gradient import *
+from algorithms.profiling import profiler
 
-def VQE(n_qubits, n_layer, op, ansatz, params, shots, instance, lr, n_reps):
+def VQE(n_qubits, n_layer, op, ansatz, params, shots, instance, lr, n_reps, pool=None, profile_path=None):
+    # profile_path: optional JSON file receiving the profile of the run (stage timers, counters and
+    # time series, see algorithms/profiling.py), also returned in log['profile']
+    if profile_path is not None:
+        profiler.enable()
     log = {}
     log['energies'] = []
     log['err_energies'] = []
@@ -17,10 +22,11 @@ def VQE(n_qubits, n_layer, op, ansatz, params, shots, instance, lr, n_reps):
             print('Energy:', E[0])
             print('========================= \n')
         log['energies'].append(E[0])
+        profiler.sample('energy', E[0])
         log['err_energies'].append(E[1])
 
         # Measure gradients
-        g = gradient(n_qubits, n_layer, op, ansatz, curr_params, shots, instance)
+        g = gradient(n_qubits, n_layer, op, ansatz, curr_params, shots, instance, pool)
 
         log['gradients'].append(g[:, 0])
         #         print(g)
@@ -29,4 +35,8 @@ def VQE(n_qubits, n_layer, op, ansatz, params, shots, instance, lr, n_reps):
 
         curr_params = curr_params - lr * g[:, 0]
     log["curr_params"] = curr_params
+    if profile_path is not None:
+        profiler.dump(profile_path)
+        log['profile'] = profiler.summary()
+        profiler.disable()
     return log
\ No newline at end of file
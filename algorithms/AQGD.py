@@ -22,6 +22,8 @@ from qiskit.aqua import AquaError
 from qiskit.aqua.components.optimizers import Optimizer, OptimizerSupportLevel
 from qiskit.aqua.utils.validation import validate_range_exclusive_max
 
+from algorithms.profiling import profiler
+
 logger = logging.getLogger(__name__)
 
 class AQGD(Optimizer):
@@ -44,7 +46,8 @@ class AQGD(Optimizer):
     the objective function.
 
     """
-    _OPTIONS = ['maxiter', 'eta', 'tol', 'disp', 'momentum', 'param_tol', 'averaging']
+    _OPTIONS = ['maxiter', 'eta', 'tol', 'disp', 'momentum', 'param_tol', 'averaging',
+                'step_mode', 'trust_radius', 'metric_refresh']
 
     def __init__(self,
                  maxiter: Union[int, List[int]] = 1000,
@@ -53,7 +56,10 @@ class AQGD(Optimizer):
                  disp: bool = False,
                  momentum: Union[float, List[float]] = 0.25,
                  param_tol: float = 1e-6,
-                 averaging: int = 10) -> None:
+                 averaging: int = 10,
+                 step_mode: str = 'gradient',
+                 trust_radius: float = 0.5,
+                 metric_refresh: int = 10) -> None:
         """
         Performs Analytical Quantum Gradient Descent (AQGD) with Epochs.
 
@@ -70,9 +76,21 @@ class AQGD(Optimizer):
             param_tol: Tolerance for change in norm of parameters.
             averaging: Length of window over which to average objective values for objective
                 convergence criterion
+            step_mode: 'gradient' for momentum gradient steps, 'natural' for momentum steps
+                along the natural gradient (the gradient preconditioned by the metric tensor
+                given to ``optimize`` as ``metric_function``; as the metric of a single Pauli
+                rotation is 1/4, ``eta`` should be about 4 times smaller than for 'gradient'
+                steps), or 'newton' for trust region
+                Newton steps from the analytical hessian (``eta`` and ``momentum`` are then
+                unused). Newton steps cost 2*(number parameters)**2 + 1 evaluations each but
+                need far fewer iterations, which pays off for few parameters.
+            trust_radius: Initial trust region radius of the 'newton' step mode.
+            metric_refresh: Number of iterations of the 'natural' step mode between two
+                evaluations of the metric tensor.
 
         Raises:
-            AquaError: If the length of ``maxiter``, `momentum``, and ``eta`` is not the same.
+            AquaError: If the length of ``maxiter``, `momentum``, and ``eta`` is not the same,
+                or if ``step_mode`` is unknown.
         """
         super().__init__()
         if isinstance(maxiter, int):
@@ -86,6 +104,9 @@ class AQGD(Optimizer):
                             "and `momentum` must have the same length.")
         for m in momentum:
             validate_range_exclusive_max('momentum', m, 0, 1)
+        if step_mode not in ('gradient', 'natural', 'newton'):
+            raise AquaError("AQGD step_mode must be 'gradient', 'natural' or 'newton', "
+                            "not {}".format(step_mode))
 
         self._eta = eta
         self._maxiter = maxiter
@@ -93,6 +114,9 @@ class AQGD(Optimizer):
         self._param_tol = param_tol
         self._tol = tol
         self._averaging = averaging
+        self._step_mode = step_mode
+        self._trust_radius = trust_radius
+        self._metric_refresh = metric_refresh
         if disp:
             warnings.warn('The disp parameter is deprecated as of '
                           '0.8.0 and will be removed no sooner than 3 months after the release. '
@@ -106,50 +130,90 @@ class AQGD(Optimizer):
         self._eval_count = 0    # function evaluations
         self._prev_loss = []    # type: List[float]
         self._prev_grad = []    # type: List[List[float]]
+        self._checkpoint = None
 
     def get_support_level(self) -> Dict[str, OptimizerSupportLevel]:
         """ Support level dictionary
 
         Returns:
             Dict[str, int]: gradient, bounds and initial point
-                            support information that is ignored/required.
+                            support information that is supported/ignored/required.
         """
         return {
-            'gradient': OptimizerSupportLevel.ignored,
+            'gradient': OptimizerSupportLevel.supported,
             'bounds': OptimizerSupportLevel.ignored,
             'initial_point': OptimizerSupportLevel.required
         }
 
 
+    def set_checkpoint(self, callback: Callable, every: int = 1) -> None:
+        """
+        Sets a callback receiving the full optimization state every ``every`` iterations, after
+        the parameter update: parameters, momentum, objective history, convergence windows,
+        evaluation and iteration counts, epoch, trust radius and metric. Passing this state back
+        to ``optimize`` resumes the optimization where it was.
+
+        Args:
+            callback: Callable taking the state dictionary, or None to disable checkpoints
+            every: Number of iterations between two checkpoints
+        """
+        self._checkpoint = None if callback is None else (callback, every)
+
+    def _evaluate(self, obj: Callable, param_sets: np.ndarray) -> np.ndarray:
+        """
+        Evaluates the objective function on every row of ``param_sets``. If evaluations may be
+        grouped (see ``set_max_evals_grouped``), the objective function is called on 2-D arrays
+        of up to ``max_evals_grouped`` rows at once and must return one value per row.
+
+        Args:
+            obj: Objective function of interest
+            param_sets: Parameter sets to evaluate, one per row
+
+        Returns:
+            Array of objective values, one per row of ``param_sets``.
+        """
+        profiler.count('aqgd.evaluations', len(param_sets))
+        with profiler.timer('aqgd.objective'):
+            if self._max_evals_grouped is None or self._max_evals_grouped <= 1:
+                return np.array([obj(row) for row in param_sets], dtype=float)
+
+            group = int(self._max_evals_grouped)
+            values = [np.asarray(obj(param_sets[i:i + group]), dtype=float).reshape(-1)
+                      for i in range(0, len(param_sets), group)]
+            return np.concatenate(values)
+
     def _compute_objective_fn_and_gradient(self, params: List[float],
-                                           obj: Callable) -> Tuple[float, np.array]:
+                                           obj: Callable,
+                                           gradient_function: Callable = None
+                                           ) -> Tuple[float, np.array]:
         """
         Obtains the objective function value for params and the analytical quantum derivatives of
         the objective function with respect to each parameter. Requires
-        2*(number parameters) + 1 objective evaluations
+        2*(number parameters) + 1 objective evaluations, or a single one when a gradient
+        function (e.g. an adjoint-mode statevector gradient) is given.
 
         Args:
             params: Current value of the parameters to evaluate the objective function
             obj: Objective function of interest
+            gradient_function: Gradient of the objective function, optional
 
         Returns:
             Tuple containing the objective value and array of gradients for the given parameter set.
         """
 
         num_params = len(params)
+        if gradient_function is not None:
+            obj_value = self._evaluate(obj, np.reshape(params, (1, num_params)))[0]
+            self._eval_count += 1
+            return obj_value, np.asarray(gradient_function(params), dtype=float)
 
         param_sets_to_eval = params + np.concatenate(
             (np.zeros((1, num_params)),  # copy of the parameters as is
              np.eye(num_params) * np.pi / 2,  # copy of the parameters with the positive shift
              -np.eye(num_params) * np.pi / 2),  # copy of the parameters with the negative shift
             axis=0)
-        # Evaluate,
-        # reshaping to flatten, as expected by objective function
-
-        n=np.shape(param_sets_to_eval)[0]
-        values=np.zeros(n)
-        for i in range(n):
-            values[i] = np.array(obj(param_sets_to_eval[i,:]))
+        # Evaluate
+        values = self._evaluate(obj, param_sets_to_eval)
 
         # Update number of objective function evaluations
         self._eval_count += 2 * num_params + 1
@@ -162,79 +226,166 @@ class AQGD(Optimizer):
         return obj_value, gradient
 
 # begin addition from oriel
-    def helper_hessian(self,num_params):
-        x=np.array([1,1,-1,-1])
-        y=np.array([1,-1,1,-1])
-        conc=np.zeros((1,num_params))
-        for i in range(num_params):
-            for j in range(i,num_params):
-                A=np.zeros((4,num_params))
-                B=np.zeros((4,num_params))
-                A[:,i]=x
-                B[:,j]=y
-                conc=np.concatenate((conc,np.pi/2*(A+B)),axis=0)
-        return conc
-
-    def symmetrize(self,a,num_vars):
+    def _hessian_shifts(self, num_params: int) -> np.ndarray:
+        """
+        Shift table of the parameter-shift Hessian, preallocated and without duplicated points:
+        the unshifted parameters, the +-pi/2 single-parameter shifts (shared with the gradient
+        and the diagonal of the Hessian), then the four (+-pi/2, +-pi/2) shifts of every pair
+        of parameters i < j.
+
+        Args:
+            num_params: Number of parameters
+
+        Returns:
+            Array of 2*(number parameters)**2 + 1 shifts, one per row.
         """
-        Return a symmetric matrix from a triangular matrix a
-        a: flatten triangular matrix (without the zeros)
+        rows, cols = np.triu_indices(num_params, k=1)
+        num_pairs = len(rows)
+        shifts = np.zeros((1 + 2 * num_params + 4 * num_pairs, num_params))
+        shifts[1:num_params + 1] = np.eye(num_params) * np.pi / 2
+        shifts[num_params + 1:2 * num_params + 1] = -np.eye(num_params) * np.pi / 2
+
+        pairs = np.zeros((num_pairs, 4, num_params))
+        pairs[np.arange(num_pairs), :, rows] = np.array([1, 1, -1, -1]) * np.pi / 2
+        pairs[np.arange(num_pairs), :, cols] = np.array([1, -1, 1, -1]) * np.pi / 2
+        shifts[2 * num_params + 1:] = pairs.reshape(-1, num_params)
+        return shifts
+
+    def _compute_objective_fn_gradient_and_hessian(self, params: List[float], obj: Callable,
+                                                   obj_value: float = None
+                                                   ) -> Tuple[float, np.array, np.array]:
         """
+        Obtains the objective function value for params, and the analytical quantum gradient and
+        hessian matrix of the objective function with respect to each parameter. Requires
+        2*(number parameters)**2 + 1 objective evaluations, or one less if the objective value
+        at params is already known. As for the gradient, every parameter is assumed to enter a
+        single Pauli rotation, so that the diagonal of the hessian is obtained from the
+        gradient evaluations: d^2f/dx_i^2 = (f(x + pi/2 e_i) + f(x - pi/2 e_i))/2 - f(x).
 
-        grad=np.zeros((num_vars,num_vars))
-        new_index=0
-        old_index=0
-        for i in range(num_vars):
-            if i!=0:
-                if i!=1:
-                    old_index=new_index
-                else:
-                    new_index-=1
-                new_index+=i
-            grad[i,i:]=a[i*num_vars-(old_index):(i+1)*num_vars-new_index]
-            if i==0:
-                new_index=1
+        Args:
+            params: Current value of the parameters to evaluate the objective function
+            obj: Objective function of interest
+            obj_value: Objective function value at params, if already evaluated
 
-        return grad + grad.T - np.diag(grad.diagonal())
+        Returns:
+            Tuple containing the objective value, the gradient and the hessian for the given
+            parameter set.
+        """
+        num_params = len(params)
+        param_sets_to_eval = params + self._hessian_shifts(num_params)
+        if obj_value is None:
+            values = self._evaluate(obj, param_sets_to_eval)
+        else:
+            values = np.concatenate(([obj_value], self._evaluate(obj, param_sets_to_eval[1:])))
+            param_sets_to_eval = param_sets_to_eval[1:]
+        # Update number of objective function evaluations
+        self._eval_count += len(param_sets_to_eval)
+
+        obj_value = values[0]
+        plus = values[1:num_params + 1]
+        minus = values[num_params + 1:2 * num_params + 1]
+        gradient = 0.5 * (plus - minus)
+
+        hessian = np.diag(0.5 * (plus + minus) - obj_value)
+        rows, cols = np.triu_indices(num_params, k=1)
+        pairs = values[2 * num_params + 1:].reshape(-1, 4)
+        mixed = 0.25 * (pairs[:, 0] - pairs[:, 1] - pairs[:, 2] + pairs[:, 3])
+        hessian[rows, cols] = mixed
+        hessian[cols, rows] = mixed
+        return obj_value, gradient, hessian
 
     def _compute_objective_fn_and_hessian(self, params: List[float],
                                            obj: Callable) -> Tuple[float, np.array]:
         """
         Obtains the objective function value for params and the analytical quantum hessian matrix of
         the objective function with respect to each parameter. Requires
-        2*(number parameters)*(number parameters +1) + 1 objective evaluations
+        2*(number parameters)**2 + 1 objective evaluations, see
+        ``_compute_objective_fn_gradient_and_hessian``.
 
         Args:
             params: Current value of the parameters to evaluate the objective function
             obj: Objective function of interest
 
         Returns:
-            Tuple containing the objective value and array of gradients for the given parameter set.
+            Tuple containing the objective value and the hessian for the given parameter set.
         """
+        obj_value, _, hessian = self._compute_objective_fn_gradient_and_hessian(params, obj)
+        return obj_value, hessian
 
-        num_params = len(params)
-        param_sets_to_eval = params + self.helper_hessian(num_params)
-        # Evaluate,
-        # reshaping to flatten, as expected by objective function
-
-        n=np.shape(param_sets_to_eval)[0]
-        values=np.zeros(n)
-        for i in range(n):
-            values[i] = np.array(obj(param_sets_to_eval[i,:]))
-        # Update number of objective function evaluations
-        self._eval_count += 2*num_params*(num_params+1) + 1
+    def _newton_step(self, gradient: np.array, hessian: np.array,
+                     radius: float) -> Tuple[np.array, float]:
+        """
+        Regularized Newton step (hessian + shift * identity) d = -gradient, minimizing the
+        quadratic model within the trust region |d| <= radius. The shift is zero for an
+        interior Newton step, and otherwise found by bisection so that |d| = radius.
 
-        # return the objective function value
-        obj_value = values[0]
-        values=values[1:].reshape(-1,4)
-        hessian=self.symmetrize(0.25*(values[:,0]-values[:,1]-values[:,2]+values[:,3]),num_params)
+        Args:
+            gradient: Gradient of the objective function
+            hessian: Hessian of the objective function
+            radius: Trust region radius
 
-        return obj_value, hessian
+        Returns:
+            Tuple of the step and the decrease of the objective predicted by the quadratic model.
+        """
+        eigvals, eigvecs = np.linalg.eigh(hessian)
+        g = eigvecs.T @ gradient
+
+        def step_norm(shift):
+            return np.linalg.norm(g / (eigvals + shift))
+
+        shift = max(0., -eigvals[0]) + 1e-10 * max(1., np.abs(eigvals).max())
+        if step_norm(shift) > radius:
+            low, high = shift, shift + np.linalg.norm(gradient) / radius
+            for _ in range(100):
+                shift = 0.5 * (low + high)
+                if step_norm(shift) > radius:
+                    low = shift
+                else:
+                    high = shift
+            shift = high
+        step = -eigvecs @ (g / (eigvals + shift))
+
+        # hard case: move along the lowest curvature direction up to the trust region boundary
+        if eigvals[0] < 0 and np.linalg.norm(step) < radius:
+            step += np.sqrt(radius**2 - np.linalg.norm(step)**2) * eigvecs[:, 0]
 
-        def mixed_derivative(self,param1,param2,obj):
-            '''
-            compute mixed derivative del^2obj/del param1 del param2
-            '''
+        predicted = -(gradient @ step + 0.5 * step @ hessian @ step)
+        return step, predicted
+
+    def _trust_region_update(self, params: np.array, objval: float, gradient: np.array,
+                             hessian: np.array, radius: float,
+                             obj: Callable) -> Tuple[np.array, float, float]:
+        """
+        Trust region Newton update: the step is accepted if the objective decreases, and the
+        radius is adapted from the ratio of actual to predicted decrease. Costs one objective
+        evaluation per trial step, and the accepted value is reused by the next hessian.
+
+        Args:
+            params: Current value of the parameters
+            objval: Objective function value at params
+            gradient: Gradient of objective wrt parameters
+            hessian: Hessian of objective wrt parameters
+            radius: Current trust region radius
+            obj: Objective function of interest
+
+        Returns:
+            Tuple of the updated parameters, the objective value there and the new radius.
+        """
+        while radius >= self._param_tol:
+            step, predicted = self._newton_step(gradient, hessian, radius)
+            trial = params + step
+            value = self._evaluate(obj, trial.reshape(1, -1))[0]
+            self._eval_count += 1
+
+            ratio = (objval - value) / predicted if predicted > 0 else 0.
+            if ratio < 0.25:
+                radius *= 0.25
+            elif ratio > 0.75 and np.linalg.norm(step) > 0.99 * radius:
+                radius = min(2 * radius, np.pi)
+            logger.info(" Trust radius: %f | Step ratio: %f", radius, ratio)
+            if ratio > 0:
+                return trial, value, radius
+        return params, objval, radius
 
 #end addtion from oriel
 
@@ -363,11 +514,25 @@ class AQGD(Optimizer):
                  objective_function: Callable,
                  gradient_function: Callable = None,
                  variable_bounds: List[Tuple[float, float]] = None,
-                 initial_point: np.ndarray = None) -> Tuple[np.ndarray, float, int]:
+                 initial_point: np.ndarray = None,
+                 metric_function: Callable = None,
+                 state: Dict = None) -> Tuple[np.ndarray, float, int]:
+        """
+        Perform optimization, see ``Optimizer.optimize``. The 'natural' step mode also requires
+        ``metric_function``, returning the (e.g. block-diagonal) metric tensor at given
+        parameters; it is only evaluated every ``metric_refresh`` iterations. An optimization
+        resumes from ``state``, as passed to the checkpoint callback (see ``set_checkpoint``),
+        mid-epoch if need be; ``initial_point`` is then ignored.
+
+        Raises:
+            AquaError: If the 'natural' step mode is used without a metric function.
+        """
         super().optimize(num_vars, objective_function, gradient_function, variable_bounds,
                          initial_point)
+        if self._step_mode == 'natural' and metric_function is None:
+            raise AquaError("The 'natural' step mode of AQGD requires a metric function.")
 
-        params = np.array(initial_point)
+        params = np.array(initial_point, dtype=float)
         momentum = np.zeros(shape=(num_vars,))
         cost = []
         # empty out history of previous objectives/gradients/parameters
@@ -378,11 +543,32 @@ class AQGD(Optimizer):
         self._eval_count = 0    # function evaluations
 
         iter_count = 0
+        start_epoch = 0
+        # trust region state of the 'newton' step mode
+        radius = self._trust_radius
+        next_objval = None
+        # metric tensor of the 'natural' step mode, kept for metric_refresh iterations
+        metric = None
+
+        if state is not None:
+            params = np.array(state['params'], dtype=float)
+            momentum = np.array(state['momentum'], dtype=float)
+            cost = list(state['cost'])
+            self._prev_loss = list(state['prev_loss'])
+            self._prev_grad = list(state['prev_grad'])
+            self._prev_param = state.get('prev_param')
+            self._eval_count = int(state['eval_count'])
+            iter_count = int(state['iter_count'])
+            start_epoch = int(state['epoch'])
+            radius = float(state['radius'])
+            next_objval = state.get('next_objval')
+            metric = state.get('metric')
         logger.info("Initial Params: %s", params)
 
-        epoch = 0
         converged = False
-        for (eta, mom_coeff) in zip(self._eta, self._momenta_coeff):
+        for epoch, (eta, mom_coeff) in enumerate(zip(self._eta, self._momenta_coeff)):
+            if epoch < start_epoch:
+                continue
             logger.info("Epoch: %4d | Stepsize: %6.4f | Momentum: %6.4f", epoch, eta, mom_coeff)
             if self._disp:
                 print("Epoch: {:4d} | Stepsize: {:6.4f} | Momentum: {:6.4f}"
@@ -399,9 +585,17 @@ class AQGD(Optimizer):
                     break
 
                 # Calculate objective function and estimate of analytical gradient
-                objval, gradient = \
-                    self._compute_objective_fn_and_gradient(params, objective_function)
+                with profiler.timer('aqgd.gradient'):
+                    if self._step_mode == 'newton':
+                        objval, gradient, hessian = self._compute_objective_fn_gradient_and_hessian(
+                            params, objective_function, next_objval)
+                    else:
+                        objval, gradient = \
+                            self._compute_objective_fn_and_gradient(params, objective_function,
+                                                                    gradient_function)
                 cost.append(objval)
+                profiler.count('aqgd.iterations')
+                profiler.sample('aqgd.cost', objval)
                 logger.info(" Iter: %4d | Obj: %11.6f | Grad Norm: %f",
                             iter_count, objval, np.linalg.norm(gradient, ord=np.inf))
                 if self._disp:
@@ -413,13 +607,36 @@ class AQGD(Optimizer):
                 if converged:
                     break
 
-                # Update parameters and momentum
-                params, momentum = self._update(params, gradient, momentum, eta, mom_coeff)
+                if self._step_mode == 'newton':
+                    params, next_objval, radius = self._trust_region_update(
+                        params, objval, gradient, hessian, radius, objective_function)
+                    converged = radius < self._param_tol
+                    if converged:
+                        logger.info("Trust radius below parameter tolerance: %f", radius)
+                        break
+                else:
+                    if self._step_mode == 'natural':
+                        if metric is None or (iter_count - 1) % self._metric_refresh == 0:
+                            with profiler.timer('aqgd.metric'):
+                                metric = np.asarray(metric_function(params), dtype=float)
+                            # small regularization of the (possibly singular) metric
+                            metric = metric + 1e-3 * np.eye(num_vars)
+                        gradient = np.linalg.solve(metric, gradient)
+
+                    # Update parameters and momentum
+                    params, momentum = self._update(params, gradient, momentum, eta, mom_coeff)
+
+                if self._checkpoint is not None and iter_count % self._checkpoint[1] == 0:
+                    self._checkpoint[0]({
+                        'params': params.copy(), 'momentum': momentum.copy(), 'cost': list(cost),
+                        'prev_loss': list(self._prev_loss), 'prev_grad': list(self._prev_grad),
+                        'prev_param': self._prev_param, 'eval_count': self._eval_count,
+                        'iter_count': iter_count, 'epoch': epoch, 'radius': radius,
+                        'next_objval': next_objval, 'metric': metric})
             # end inner iteration
             # if converged, end iterating over epochs
             if converged:
                 break
-            epoch += 1
         # end epoch iteration
 
         # return last parameter values, objval estimate, and objective evaluation count
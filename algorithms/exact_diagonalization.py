@@ -0,0 +1,200 @@
+import numpy as np
+import scipy.sparse as sp
+from scipy.sparse.linalg import LinearOperator, eigsh
+
+from pauli_table import PauliTable, bit_parity
+
+# above these sizes the spectrum is computed with a CSR matrix, then matrix-free
+DENSE_MAX_QUBITS = 12
+SPARSE_MAX_QUBITS = 16
+# symmetry blocks up to this size, or whose levels are nearly all wanted, are diagonalized densely
+DENSE_MAX_BLOCK = 512
+
+
+def linear_operator(table):
+    '''scipy LinearOperator applying the Pauli sum with PauliTable.apply'''
+    _, diagonals = table.groups()
+    dim = diagonals.shape[1]
+    if np.isrealobj(diagonals):
+        matvec = lambda v: table.apply(np.ravel(v)).real
+        return LinearOperator((dim, dim), matvec=matvec, rmatvec=matvec, dtype=float)
+    matvec = lambda v: table.apply(np.ravel(v))
+    return LinearOperator((dim, dim), matvec=matvec, rmatvec=matvec, dtype=complex)
+
+
+def lowest_levels(operator, k=None, return_vectors=False, method='auto'):
+    '''
+    Args:
+        operator: PauliTable or opflow operator
+        k: number of levels, all of them if None (dense only)
+        return_vectors: also return the eigenvectors, as columns
+        method: 'dense', 'sparse' (CSR + eigsh), 'matrix_free' (LinearOperator + eigsh), or
+            'auto' to choose from the number of qubits
+    Returns:
+        lowest k energies in ascending order (and eigenvectors)
+    '''
+    table = operator if isinstance(operator, PauliTable) else PauliTable.from_operator(operator)
+    n_qubits = table.n_qubits
+    dim = 2**n_qubits
+    if method == 'auto':
+        if k is None or k >= dim - 1 or n_qubits <= DENSE_MAX_QUBITS:
+            method = 'dense'
+        elif n_qubits <= SPARSE_MAX_QUBITS:
+            method = 'sparse'
+        else:
+            method = 'matrix_free'
+
+    if method == 'dense':
+        energies, vectors = np.linalg.eigh(table.to_sparse().toarray())
+        energies, vectors = energies[:k], vectors[:, :k]
+    elif method in ('sparse', 'matrix_free'):
+        if k is None:
+            raise ValueError('the number of levels k is required by the {} method'.format(method))
+        matrix = table.to_sparse() if method == 'sparse' else linear_operator(table)
+        energies, vectors = eigsh(matrix, k=k, which='SA')
+        order = np.argsort(energies)
+        energies, vectors = energies[order], vectors[:, order]
+    else:
+        raise ValueError('unknown method {}'.format(method))
+
+    if return_vectors:
+        return energies, vectors
+    return energies
+
+
+def translation_invariant(table, atol=1e-12):
+    '''True if the Pauli sum is unchanged by the cyclic translation of the qubits q -> q+1'''
+    shifted = PauliTable(np.roll(table.x, 1, axis=1), np.roll(table.z, 1, axis=1), table.coeffs)
+    return len((table + (-1)*shifted).simplify(atol)) == 0
+
+
+def spin_flip_symmetry(table):
+    '''
+    Global parity commuting with every term: 'Z' for Z^n (even number of X/Y per term), 'X' for
+    X^n (even number of Z/Y per term), None if neither does.
+    '''
+    if np.all(np.sum(table.x, axis=1) % 2 == 0):
+        return 'Z'
+    if np.all(np.sum(table.z, axis=1) % 2 == 0):
+        return 'X'
+    return None
+
+
+def _translate(index, n_qubits):
+    # basis state with bit q moved to bit q+1 (mod n)
+    return ((index << 1) | (index >> (n_qubits - 1))) & (2**n_qubits - 1)
+
+
+def _orbit_minimum(states, n_qubits, shifts, flips):
+    # smallest image g|state> of each basis state over the group of translations T^r and flips F^s,
+    # and the (r, s) of the first g reaching it
+    full = 2**n_qubits - 1
+    minimum, best_r, best_s = states.copy(), np.zeros(len(states), dtype=int), np.zeros(len(states), dtype=int)
+    image = states
+    for r in shifts:
+        for s in flips:
+            candidate = image ^ full if s else image
+            smaller = candidate < minimum
+            minimum[smaller], best_r[smaller], best_s[smaller] = candidate[smaller], r, s
+        image = _translate(image, n_qubits)
+    return minimum, best_r, best_s
+
+
+def sector_levels(operator, k=6, translation=None, parity=None):
+    '''
+    Spectrum resolved in the parity x momentum sectors, in the basis of symmetrized representative
+    states |a> ~ sum_g conj(chi(g)) g|a>. The block of each sector is assembled directly in this basis
+    by applying the Pauli terms to the representatives, so neither the full Hamiltonian nor the
+    projection on the sector is ever built: the block is about 2n times smaller than the full matrix.
+
+    Args:
+        operator: PauliTable or opflow operator
+        k: number of levels per sector
+        translation: use the translation symmetry (pbc), detected from the terms if None
+        parity: 'X', 'Z' or False, detected from the terms if None (see spin_flip_symmetry)
+    Returns:
+        dictionary {(momentum, parity): lowest k energies of the sector}; the momentum q labels the
+        translation eigenvalue exp(2i pi q/n), the parity is +1 or -1
+    '''
+    table = operator if isinstance(operator, PauliTable) else PauliTable.from_operator(operator)
+    n_qubits = table.n_qubits
+    dim = 2**n_qubits
+    if translation is None:
+        translation = translation_invariant(table)
+    if parity is None:
+        parity = spin_flip_symmetry(table)
+
+    shifts = range(n_qubits) if translation else range(1)
+    flips = (0, 1) if parity == 'X' else (0,)
+    order = len(shifts)*len(flips)
+
+    # representatives: the basis states that are the smallest index of their orbit
+    index = np.arange(dim)
+    representatives = index[_orbit_minimum(index, n_qubits, shifts, flips)[0] == index]
+
+    # terms grouped by X mask: P|a> = i^n_y (-1)^parity(a & z) |a ^ x>
+    xmasks, zmasks = table.masks()
+    n_y = np.sum(table.x & table.z, axis=1)
+    masks, inverse = np.unique(xmasks, return_inverse=True)
+    inverse = inverse.reshape(-1)
+
+    sectors = {}
+    for q in shifts:
+        for p in ((1, -1) if parity else (1,)):
+            reps = representatives
+            if parity == 'Z':
+                reps = reps[(1 - 2*bit_parity(reps, dim - 1)) == p]
+
+            def character(r, s):
+                return np.exp(-2j*np.pi*q*r/n_qubits)*p**s
+
+            # norm of sum_g conj(chi(g)) g|a>: |G|/|S_a| |sum of chi over the stabilizer S_a|^2, zero when
+            # chi is not trivial on S_a (no state of the sector)
+            stabilizer, weight = np.zeros(len(reps)), np.zeros(len(reps), dtype=complex)
+            image = reps
+            for r in shifts:
+                for s in flips:
+                    fixed = (image ^ (dim - 1) if s else image) == reps
+                    stabilizer += fixed
+                    weight += fixed*character(r, s)
+                image = _translate(image, n_qubits)
+            norms = np.sqrt(order/stabilizer)*np.abs(weight)
+            reps, norms = reps[norms > 1e-9], norms[norms > 1e-9]
+            if len(reps) == 0:
+                continue
+
+            # H|a~> = sum_terms h(a) chi(g_j) N_b/N_a |b~>, the image j = a ^ x being g_j^-1|b>
+            rows, cols, data = [], [], []
+            columns = np.arange(len(reps))
+            for m, mask in enumerate(masks):
+                terms = np.flatnonzero(inverse == m)
+                amplitude = np.zeros(len(reps), dtype=complex)
+                for t in terms:
+                    amplitude += table.coeffs[t]*1j**n_y[t]*(1 - 2*bit_parity(reps, zmasks[t]))
+                target, r, s = _orbit_minimum(reps ^ mask, n_qubits, shifts, flips)
+                position = np.minimum(np.searchsorted(reps, target), len(reps) - 1)
+                found = (reps[position] == target) & (amplitude != 0)
+                rows.append(position[found])
+                cols.append(columns[found])
+                data.append((amplitude*character(r, s)*norms[position]/norms)[found])
+            block = sp.csr_matrix((np.concatenate(data), (np.concatenate(rows), np.concatenate(cols))),
+                                  shape=(len(reps), len(reps)))
+
+            if len(reps) <= DENSE_MAX_BLOCK or 4*k >= len(reps):
+                energies = np.linalg.eigvalsh(block.toarray())[:k]
+            else:
+                energies = np.sort(eigsh(block, k=k, which='SA')[0])
+            sectors[(q, p)] = energies
+    return sectors
+
+
+def labelled_levels(sectors, k=None):
+    '''
+    Args:
+        sectors: output of sector_levels
+        k: number of levels to keep
+    Returns:
+        list of (energy, momentum, parity) in ascending energy
+    '''
+    levels = sorted((float(energy), q, p) for (q, p), energies in sectors.items() for energy in energies)
+    return levels[:k]
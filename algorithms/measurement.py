@@ -0,0 +1,174 @@
+import numpy as np
+from qiskit import QuantumCircuit
+
+from pauli_table import PauliTable, bit_parity
+
+# basis changes per Hamiltonian structure (Pauli strings without coefficients)
+_MEASUREMENTS = {}
+
+
+def conflict_graph(table, qubit_wise=True):
+    '''
+    Adjacency matrix of the terms that cannot be measured together: those acting with different
+    Paulis on a common qubit (qubit_wise), or those anticommuting (general commutation).
+    '''
+    x, z = table.x, table.z
+    if qubit_wise:
+        support = x | z
+        differ = (x[:, None] != x[None]) | (z[:, None] != z[None])
+        return np.any(support[:, None] & support[None] & differ, axis=-1)
+    x, z = x.astype(int), z.astype(int)
+    return (x @ z.T + z @ x.T) % 2 == 1
+
+
+def commuting_groups(table, qubit_wise=True):
+    '''
+    Partition of the terms into commuting groups by greedy coloring of the conflict graph, the
+    terms of largest degree being colored first.
+
+    Args:
+        table: PauliTable
+        qubit_wise: qubit-wise commuting groups (measured with single-qubit rotations), or
+            general commuting groups (measured after a Clifford circuit)
+    Returns:
+        list of arrays of term indices
+    '''
+    conflicts = conflict_graph(table, qubit_wise)
+    colors = np.full(len(table), -1)
+    for t in np.argsort(-conflicts.sum(axis=1), kind='stable'):
+        used = set(colors[conflicts[t]])
+        colors[t] = next(c for c in range(len(table)) if c not in used)
+    return [np.flatnonzero(colors == c) for c in range(colors.max() + 1)]
+
+
+def _conjugate(x, z, sign, gate, qubits):
+    '''Pauli strings (rows) conjugated in place by a Clifford gate, sign being the -1 exponent'''
+    if gate == 'cz':
+        _conjugate(x, z, sign, 'h', qubits[1:])
+        _conjugate(x, z, sign, 'cx', qubits)
+        _conjugate(x, z, sign, 'h', qubits[1:])
+        return
+    if gate == 'cx':
+        a, b = qubits
+        sign ^= x[:, a] & z[:, b] & ~(x[:, b] ^ z[:, a])
+        x[:, b] ^= x[:, a]
+        z[:, a] ^= z[:, b]
+        return
+    q = qubits[0]
+    if gate == 'h':
+        sign ^= x[:, q] & z[:, q]
+        x[:, q], z[:, q] = z[:, q].copy(), x[:, q].copy()
+    elif gate == 's':
+        sign ^= x[:, q] & z[:, q]
+        z[:, q] ^= x[:, q]
+    elif gate == 'sdg':
+        sign ^= x[:, q] & ~z[:, q]
+        z[:, q] ^= x[:, q]
+
+
+def _qubit_wise_gates(x, z):
+    '''H on the qubits measured in X, S^dagger then H on those measured in Y'''
+    x, z = np.any(x, axis=0), np.any(z, axis=0)
+    gates = [('sdg', (q,)) for q in np.flatnonzero(x & z)]
+    return gates + [('h', (q,)) for q in np.flatnonzero(x)]
+
+
+def _clifford_gates(x, z):
+    '''
+    Clifford circuit mapping commuting Pauli strings onto Z strings: Hadamards making the X block
+    of independent generators full rank, CNOTs reducing it to one pivot qubit per generator, CZs
+    and S clearing the Z block, then Hadamards on the pivots.
+    '''
+    n = x.shape[1]
+    x, z = x.copy(), z.copy()
+    sign = np.zeros(len(x), dtype=bool)
+    gates = []
+
+    def apply(gate, qubits):
+        gates.append((gate, qubits))
+        _conjugate(x, z, sign, gate, qubits)
+
+    # independent generators in reduced form, pivots[i] being the only X of generator i on its column
+    pivots, rows = [], []
+    for t in range(len(x)):
+        for p, r in zip(pivots, rows):
+            if x[t, p]:
+                x[t] ^= x[r]
+                z[t] ^= z[r]
+        columns = [c for c in np.flatnonzero(x[t]) if c not in pivots]
+        if not columns:
+            columns = [c for c in np.flatnonzero(z[t]) if c not in pivots]
+            if not columns:
+                continue    # product of the previous generators
+            apply('h', (columns[0],))
+        c = columns[0]
+        for r in rows:
+            if x[r, c]:
+                x[r] ^= x[t]
+                z[r] ^= z[t]
+        pivots.append(c)
+        rows.append(t)
+
+    for p, r in zip(pivots, rows):
+        for c in range(n):
+            if c not in pivots and x[r, c]:
+                apply('cx', (p, c))
+    for i, (p, r) in enumerate(zip(pivots, rows)):
+        for c in range(n):
+            if c != p and z[r, c] and (c not in pivots or pivots.index(c) > i):
+                apply('cz', (p, c))
+        if z[r, p]:
+            apply('s', (p,))
+    for p in pivots:
+        apply('h', (p,))
+    return gates
+
+
+def measurement_groups(table, qubit_wise=True):
+    '''
+    Commuting groups of the terms with their basis change, computed once per Hamiltonian structure
+    so that Hamiltonians differing only by their coefficients share them.
+
+    Args:
+        table: PauliTable
+        qubit_wise: see commuting_groups
+    Returns:
+        list of (group, circuit, supports, signs): after the basis change circuit, term group[k]
+        is signs[k] times the product of Z on the qubits of the bit mask supports[k]
+    '''
+    key = (table.n_qubits, qubit_wise, np.packbits(table.x).tobytes(), np.packbits(table.z).tobytes())
+    if key not in _MEASUREMENTS:
+        measurements = []
+        for group in commuting_groups(table, qubit_wise):
+            x, z = table.x[group], table.z[group]
+            gates = _qubit_wise_gates(x, z) if qubit_wise else _clifford_gates(x, z)
+
+            circuit = QuantumCircuit(table.n_qubits)
+            for gate, qubits in gates:
+                getattr(circuit, gate)(*qubits)
+            x, z, sign = x.copy(), z.copy(), np.zeros(len(group), dtype=bool)
+            for gate, qubits in gates:
+                _conjugate(x, z, sign, gate, qubits)
+
+            supports = PauliTable(x, z, np.ones(len(group))).masks()[1]
+            measurements.append((group, circuit, supports, 1 - 2*sign.astype(int)))
+        _MEASUREMENTS[key] = measurements
+    return _MEASUREMENTS[key]
+
+
+def counts_statistics(counts, supports, coeffs):
+    '''
+    Args:
+        counts: measurement counts of a group (qiskit bitstrings, qubit 0 rightmost)
+        supports: bit masks of the Z strings measured, see measurement_groups
+        coeffs: coefficients of the Z strings (signs included)
+    Returns:
+        mean of the group observable and its variance per shot
+    '''
+    outcomes = np.array([int(key.replace(' ', ''), 2) for key in counts])
+    frequencies = np.array(list(counts.values()), dtype=float)
+    frequencies /= frequencies.sum()
+    signs = 1 - 2*bit_parity(outcomes[:, None], supports[None, :])
+    values = signs @ coeffs
+    mean = frequencies @ values
+    return mean, max(frequencies @ values**2 - mean**2, 0.)
@@ -0,0 +1,119 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from algorithms.measurement import counts_statistics
+from algorithms.statevector import StatevectorSimulator
+
+# objective of a worker process, built once by the pool initializer
+_objective = None
+
+
+def _initialize(factory, args):
+    global _objective
+    _objective = factory(*args)
+
+
+def _evaluate(parameters, seeds, extra):
+    return _objective(parameters, seeds, *extra)
+
+
+class EvaluationPool:
+    '''
+    Long-lived worker processes evaluating an objective on stacked parameter sets. Every worker
+    builds the objective once with factory(*args) (e.g. the compiled ansatz and the Hamiltonian),
+    so that afterwards only parameter vectors cross the process boundary. The parameter sets are
+    split in contiguous chunks and the results are returned in their order. Every parameter set
+    gets its own seed, drawn from the pool seed and the call number, so that results do not depend
+    on the number of workers or on the scheduling. The workers are spawned rather than forked: a fork
+    after an Aer run copies the locked mutexes of its thread pool and deadlocks the children.
+    '''
+
+    def __init__(self, factory, args=(), workers=None, seed=None):
+        '''
+        Args:
+            factory: picklable callable returning objective(parameters, seeds, *extra), evaluating
+                a 2-D array of parameter sets and returning one result per row
+            args: arguments of factory, sent once to every worker
+            workers: number of processes, os.cpu_count() by default
+            seed: seed of the per parameter set seeds, random if None
+        '''
+        self.workers = workers or os.cpu_count()
+        self.seed = np.random.SeedSequence(seed).entropy
+        self._calls = 0
+        self._executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('spawn'),
+                                             initializer=_initialize, initargs=(factory, args))
+
+    def __call__(self, parameters, *extra):
+        '''
+        Args:
+            parameters: 2-D array of parameter sets
+            extra: further arguments of the objective, sent with every chunk
+        Returns:
+            array of the results, in the order of the parameter sets
+        '''
+        parameters = np.atleast_2d(parameters)
+        seeds = np.random.SeedSequence([self.seed, self._calls]).generate_state(len(parameters))
+        self._calls += 1
+        chunks = np.array_split(np.arange(len(parameters)), min(self.workers, len(parameters)))
+        results = self._executor.map(_evaluate, [parameters[chunk] for chunk in chunks],
+                                     [seeds[chunk] for chunk in chunks], [extra]*len(chunks))
+        return np.concatenate([np.asarray(result) for result in results])
+
+    def close(self):
+        self._executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def statevector_energy(n_qubits, gates, table, references=None, shift=0):
+    '''
+    Pool factory: energies of the parameter sets with the NumPy statevector engine, optionally
+    penalized by shift*sum_j |<reference_j|psi>|^2, the reference statevectors being sent once with
+    the other arguments
+    '''
+    simulator = StatevectorSimulator(n_qubits)
+    program = simulator.compile(gates)
+
+    def objective(parameters, seeds):
+        psi = simulator.statevector(program, parameters)
+        energy = table.expectation(psi)
+        if references is not None and len(references):
+            energy = energy + shift*np.sum(np.abs(psi @ np.conj(references).T)**2, axis=-1)
+        return energy
+
+    return objective
+
+
+def sampled_energy(circuits, parameters, observables, backend, shots):
+    '''
+    Pool factory: sampled energies and standard errors of the parameter sets, from the measured
+    circuits of the commuting groups on the ansatz template (see VQE.group_circuits) and their
+    observables. backend is the backend itself (sent pickled to every worker) or a picklable callable
+    returning it, e.g. functools.partial(Aer.get_backend, 'qasm_simulator'). Every worker transpiles
+    the circuits once; each parameter set is sampled with its own seed.
+    '''
+    from qiskit import execute, transpile
+
+    if not hasattr(backend, 'run'):
+        backend = backend()
+    circuits = transpile(circuits, backend)
+
+    def objective(rows, seeds):
+        results = []
+        for row, seed in zip(rows, seeds):
+            bound = [circuit.assign_parameters({p: v for p, v in zip(parameters, row) if p in circuit.parameters})
+                     for circuit in circuits]
+            counts = execute(bound, backend, shots=shots, seed_simulator=int(seed), optimization_level=0).result()
+            statistics = np.array([counts_statistics(counts.get_counts(k), *observable)
+                                   for k, observable in enumerate(observables)])
+            results.append((statistics[:, 0].sum(), np.sqrt(statistics[:, 1].sum()/shots)))
+        return np.array(results)
+
+    return objective
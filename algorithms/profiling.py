@@ -0,0 +1,124 @@
+import json
+import time
+
+from qiskit.opflow.state_fns import CircuitStateFn
+
+
+class _NullTimer:
+    '''Context manager doing nothing, shared by all the timers of a disabled profiler'''
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class _Timer:
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler.record(self.name, self.start, time.perf_counter())
+        return False
+
+
+class Profiler:
+    '''
+    Named stage timers and counters of a run, with their time series. Disabled (the default), timer
+    returns a shared no-op context manager and count returns at once, so that the instrumented code
+    only pays an attribute lookup per stage.
+
+        profiler.enable()
+        with profiler.timer('sampling'):
+            ...
+        profiler.count('circuits', len(circuits))
+        profiler.dump('profile.json')
+    '''
+
+    def __init__(self):
+        self.enabled = False
+        self.reset()
+
+    def reset(self):
+        '''Forget the stages, counters and time series recorded so far'''
+        self.origin = time.perf_counter()
+        self.stages = {}
+        self.counters = {}
+        self.events = []
+        self.series = []
+
+    def enable(self, reset=True):
+        if reset:
+            self.reset()
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def timer(self, name):
+        '''Context manager timing the stage name'''
+        if not self.enabled:
+            return _NULL_TIMER
+        return _Timer(self, name)
+
+    def record(self, name, start, stop):
+        '''Add a timed run of the stage name (perf_counter start and stop)'''
+        calls, total = self.stages.get(name, (0, 0.))
+        self.stages[name] = (calls + 1, total + stop - start)
+        self.events.append((start - self.origin, name, stop - start))
+
+    def count(self, name, n=1):
+        '''Add n to the counter name'''
+        if self.enabled:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def sample(self, name, value):
+        '''Add a point to the time series of the quantity name (e.g. the objective value per iteration)'''
+        if self.enabled:
+            self.series.append((time.perf_counter() - self.origin, name, float(value)))
+
+    def summary(self):
+        '''
+        Returns:
+            dict of the wall time since the reset, the stages (calls, total and mean time in seconds,
+            by decreasing total time) and the counters
+        '''
+        stages = {name: dict(calls=calls, total=total, mean=total/calls)
+                  for name, (calls, total) in sorted(self.stages.items(), key=lambda item: -item[1][1])}
+        return dict(wall_time=time.perf_counter() - self.origin, stages=stages, counters=dict(self.counters))
+
+    def dump(self, path):
+        '''Write the summary and the time series (timer events and samples, times from the reset) as JSON'''
+        report = self.summary()
+        report['events'] = [dict(time=t, stage=name, duration=duration) for t, name, duration in self.events]
+        report['series'] = [dict(time=t, name=name, value=value) for t, name, value in self.series]
+        with open(path, 'w') as file:
+            json.dump(report, file, indent=2)
+
+
+# profiler of the process, shared by VQE, AQGD and the batched submissions
+profiler = Profiler()
+
+
+def circuit_count(operator):
+    '''Number of circuits sampled per parameter set to evaluate an opflow expectation'''
+    if hasattr(operator, 'oplist'):
+        return sum(circuit_count(op) for op in operator.oplist)
+    return int(isinstance(operator, CircuitStateFn))
+
+
+def count_sampled(instance, circuits):
+    '''Add circuits sampled by a QuantumInstance to the counters of circuits and shots'''
+    if profiler.enabled:
+        profiler.count('circuits', circuits)
+        if not instance.is_statevector:
+            profiler.count('shots', circuits*instance.run_config.shots)
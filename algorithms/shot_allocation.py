@@ -0,0 +1,94 @@
+import numpy as np
+
+
+def neyman_allocation(sigmas, shots, min_shots=0):
+    '''
+    Split shots among groups in proportion to their standard deviation per shot (coefficients
+    included), which minimizes the variance of the summed estimate for a fixed total.
+
+    Args:
+        sigmas: standard deviation per shot of each group
+        shots: total number of shots
+        min_shots: lower bound on the shots of every group
+    Returns:
+        integer array of shots, summing to max(shots, min_shots*len(sigmas))
+    '''
+    sigmas = np.asarray(sigmas, dtype=float)
+    if not np.any(sigmas > 0):
+        sigmas = np.ones(len(sigmas))
+    free = max(shots - min_shots*len(sigmas), 0)
+    share = free*sigmas/sigmas.sum()
+    allocation = np.floor(share).astype(int)
+    # the remaining shots go to the largest fractional parts
+    remainder = free - allocation.sum()
+    allocation[np.argsort(allocation - share)[:remainder]] += 1
+    return allocation + min_shots
+
+
+class ShotAllocator:
+    '''
+    Adaptive allocation of a shot budget across measurement groups. Shots are spent in rounds,
+    each one bringing the cumulative allocation closer to the optimal shots ~ sigma split,
+    until the estimated error of the sum reaches target_error or the budget is spent. The group
+    standard deviations are carried over from one estimate to the next (e.g. across the
+    iterations of an optimizer), starting from the bound sum_t |coeff_t| of each group.
+    '''
+
+    def __init__(self, weights, max_shots=10000, target_error=None, shots_per_round=1000,
+                 min_shots=10, decay=0.5):
+        '''
+        Args:
+            weights: initial standard deviation per shot of each group, e.g. sum of |coeffs|
+            max_shots: shot budget of one estimate
+            target_error: standard error at which sampling stops, or None to spend max_shots
+                in a single round
+            shots_per_round: shots added per round when target_error is given
+            min_shots: shots of every group in the first round (variance estimate)
+            decay: weight of the previous standard deviations when updating them
+        '''
+        self.sigmas = np.asarray(weights, dtype=float)
+        self.max_shots = max_shots
+        self.target_error = target_error
+        self.shots_per_round = shots_per_round
+        self.min_shots = min_shots
+        self.decay = decay
+
+    def estimate(self, sample):
+        '''
+        Args:
+            sample: callable taking the number of shots of every group (zero for some) and
+                returning the sampled means and variances per shot of the groups
+        Returns:
+            estimate of the sum of the groups, its standard error, and the number of shots used
+        '''
+        n_groups = len(self.sigmas)
+        shots = np.zeros(n_groups, dtype=int)
+        sums = np.zeros(n_groups)
+        squares = np.zeros(n_groups)
+        sigmas = self.sigmas.copy()
+
+        budget = self.max_shots if self.target_error is None else min(self.shots_per_round, self.max_shots)
+        allocation = neyman_allocation(sigmas, budget, self.min_shots)
+        while True:
+            means, variances = sample(allocation)
+            means, variances = np.asarray(means), np.asarray(variances)
+            taken = allocation > 0
+            # pooled first and second moments of every group
+            sums[taken] += allocation[taken]*means[taken]
+            squares[taken] += allocation[taken]*(variances[taken] + means[taken]**2)
+            shots += allocation
+
+            sampled = shots > 0
+            mean = np.where(sampled, sums/np.maximum(shots, 1), 0)
+            variance = np.where(sampled, squares/np.maximum(shots, 1) - mean**2, sigmas**2)
+            sigmas = np.sqrt(np.maximum(variance, 0))
+            error = np.sqrt(np.sum(variance[sampled]/shots[sampled]))
+
+            used = shots.sum()
+            if self.target_error is None or error <= self.target_error or used >= self.max_shots:
+                break
+            budget = min(used + self.shots_per_round, self.max_shots)
+            allocation = np.maximum(neyman_allocation(sigmas, budget) - shots, 0)
+
+        self.sigmas = self.decay*self.sigmas + (1 - self.decay)*sigmas
+        return np.sum(mean), error, used
@@ -0,0 +1,260 @@
+import numpy as np
+from qiskit.circuit import Parameter
+
+from pauli_table import PauliTable, bit_parity
+
+# Rotations exp(-i angle/2 P), P being the Pauli string on the gate qubits
+_ROTATIONS = {'rx': 'X', 'ry': 'Y', 'rz': 'Z', 'rxx': 'XX', 'ryy': 'YY', 'rzz': 'ZZ'}
+_PAULIS = {'x': 'X', 'y': 'Y', 'z': 'Z'}
+
+
+def circuit_gates(circuit, parameters=()):
+    '''
+    Args:
+        circuit: QuantumCircuit, possibly parametrized by the elements of parameters
+        parameters: ordered Parameters of the circuit (e.g. a ParameterVector)
+    Returns:
+        list of (name, qubits, index, angle): the angle of a gate is parameter[index] if index
+        is not None, and the fixed angle otherwise
+    '''
+    qubit_index = {q: i for i, q in enumerate(circuit.qubits)}
+    param_index = {p: i for i, p in enumerate(parameters)}
+
+    gates = []
+    for instruction, qargs, _ in circuit.data:
+        if instruction.name == 'barrier':
+            continue
+        qubits = tuple(qubit_index[q] for q in qargs)
+        index, angle = None, None
+        if instruction.params:
+            value = instruction.params[0]
+            if isinstance(value, Parameter):
+                index = param_index[value]
+            else:
+                # raises for parameter expressions other than a single Parameter
+                angle = float(value)
+        gates.append((instruction.name, qubits, index, angle))
+    return gates
+
+
+def parameter_blocks(gates):
+    '''
+    Layers of the circuit for block-diagonal metric approximations: a block holds the parameters
+    of a run of parametrized rotations that no fixed gate interrupts.
+
+    Args:
+        gates: list of (name, qubits, index, angle), see circuit_gates
+    Returns:
+        list of arrays of parameter indices
+    '''
+    blocks, block = [], []
+    for _, _, index, _ in gates:
+        if index is None:
+            if block:
+                blocks.append(block)
+            block = []
+        elif index not in block:
+            block.append(index)
+    if block:
+        blocks.append(block)
+
+    # parameters shared by several layers join the block of their first occurrence
+    seen = set()
+    unique = []
+    for block in blocks:
+        block = [index for index in block if index not in seen]
+        seen.update(block)
+        if block:
+            unique.append(np.array(block))
+    return unique
+
+
+class StatevectorSimulator:
+    '''
+    Pure NumPy statevector backend, to be used in place of a statevector QuantumInstance.
+    Gates are applied directly to a (batch, 2**n) array, qubit i being bit i of the basis
+    index as in qiskit.
+    '''
+
+    is_statevector = True
+
+    def __init__(self, n_qubits):
+        self.n_qubits = n_qubits
+        self.dim = 2**n_qubits
+        self._index = np.arange(self.dim)
+        self._operators = {}
+
+    def _pauli(self, qubits, label):
+        '''(perm, phase) such that (P psi)[k] = phase[k]*psi[perm[k]]'''
+        xmask, zmask, n_y = 0, 0, 0
+        for q, p in zip(qubits, label):
+            if p in 'XY':
+                xmask |= 1 << q
+            if p in 'YZ':
+                zmask |= 1 << q
+            n_y += p == 'Y'
+        perm = self._index ^ xmask
+        phase = (1j**n_y)*(1 - 2*bit_parity(perm, zmask))
+        if xmask == 0:
+            perm = None
+        return perm, phase
+
+    def compile(self, gates):
+        '''
+        Precompute the index permutation and phase of every gate.
+
+        Args:
+            gates: list of (name, qubits, index, angle), see circuit_gates
+        Returns:
+            program to be passed to statevector
+        '''
+        program = []
+        for name, qubits, index, angle in gates:
+            if name in _ROTATIONS:
+                perm, phase = self._pauli(qubits, _ROTATIONS[name])
+                program.append(('rot', index, angle, perm, phase))
+            elif name in _PAULIS:
+                perm, phase = self._pauli(qubits, _PAULIS[name])
+                program.append(('perm', None, None, perm, phase))
+            elif name == 'h':
+                perm, _ = self._pauli(qubits, 'X')
+                _, phase = self._pauli(qubits, 'Z')
+                program.append(('h', None, None, perm, phase))
+            elif name == 'cx':
+                control, target = qubits
+                perm = self._index ^ (((self._index >> control) & 1) << target)
+                program.append(('perm', None, None, perm, 1))
+            elif name == 'cz':
+                _, phase = self._pauli(qubits, 'ZZ')
+                _, phase_0 = self._pauli(qubits[:1], 'Z')
+                _, phase_1 = self._pauli(qubits[1:], 'Z')
+                # (1 + Z_0 + Z_1 - Z_0 Z_1)/2
+                program.append(('perm', None, None, None, (1 + phase_0 + phase_1 - phase)/2))
+            elif name == 'swap':
+                a, b = qubits
+                flip = ((self._index >> a) ^ (self._index >> b)) & 1
+                perm = self._index ^ (flip << a) ^ (flip << b)
+                program.append(('perm', None, None, perm, 1))
+            else:
+                raise ValueError('gate {} is not supported by the statevector simulator'.format(name))
+        return program
+
+    def _apply(self, operation, psi, theta, inverse=False):
+        kind, index, angle, perm, phase = operation
+        if kind == 'rot':
+            if index is not None:
+                angle = theta[:, index, None]
+            if inverse:
+                angle = -angle
+            moved = psi if perm is None else psi[:, perm]
+            return np.cos(angle/2)*psi - 1j*np.sin(angle/2)*phase*moved
+        # the fixed gates (h, Paulis, cx, cz, swap) are their own inverse
+        if kind == 'h':
+            return (psi[:, perm] + phase*psi)/np.sqrt(2)
+        return phase*(psi if perm is None else psi[:, perm])
+
+    def statevector(self, program, parameters):
+        '''
+        Args:
+            program: compiled gates (see compile)
+            parameters: parameter vector, or a 2-D array of parameter vectors stacked row-wise
+        Returns:
+            statevector, or (batch, 2**n) array of statevectors
+        '''
+        parameters = np.asarray(parameters, dtype=float)
+        theta = np.atleast_2d(parameters)
+        psi = np.zeros((theta.shape[0], self.dim), dtype=complex)
+        psi[:, 0] = 1
+
+        for operation in program:
+            psi = self._apply(operation, psi, theta)
+
+        if parameters.ndim == 1:
+            return psi[0]
+        return psi
+
+    def gradient(self, program, parameters, observable):
+        '''
+        Adjoint-mode gradient of <psi|O|psi>: one forward pass, then one backward pass undoing
+        the gates on both psi and O|psi>. Parameters shared by several gates accumulate.
+
+        Args:
+            program: compiled gates (see compile)
+            parameters: parameter vector
+            observable: callable returning O|psi> for a (1, 2**n) array psi
+        Returns:
+            <psi|O|psi> and its gradient
+        '''
+        theta = np.atleast_2d(np.asarray(parameters, dtype=float))
+        psi = self.statevector(program, theta)
+        lam = observable(psi)
+        value = np.vdot(psi, lam).real
+
+        gradient = np.zeros(theta.shape[1])
+        for operation in reversed(program):
+            kind, index, _, perm, phase = operation
+            if kind == 'rot' and index is not None:
+                # d/dtheta exp(-i theta/2 P) = -i/2 P exp(-i theta/2 P)
+                p_psi = phase*(psi if perm is None else psi[:, perm])
+                gradient[index] += np.vdot(lam, p_psi).imag
+            psi = self._apply(operation, psi, theta, inverse=True)
+            lam = self._apply(operation, lam, theta, inverse=True)
+        return value, gradient
+
+    def metric(self, program, parameters, blocks=None):
+        '''
+        Fubini-Study metric Re<d_i psi|d_j psi> - Re(<d_i psi|psi><psi|d_j psi>), from the
+        derivative states of all parameters propagated together in one sweep.
+
+        Args:
+            program: compiled gates (see compile)
+            parameters: parameter vector
+            blocks: optional list of parameter index arrays (see parameter_blocks), the metric
+                being then set to zero outside of the diagonal blocks
+        Returns:
+            (n_params, n_params) metric tensor
+        '''
+        theta = np.atleast_2d(np.asarray(parameters, dtype=float))
+        psi = np.zeros((1, self.dim), dtype=complex)
+        psi[0, 0] = 1
+        derivatives = np.zeros((theta.shape[1], self.dim), dtype=complex)
+
+        for operation in program:
+            kind, index, _, perm, phase = operation
+            psi = self._apply(operation, psi, theta)
+            derivatives = self._apply(operation, derivatives, theta)
+            if kind == 'rot' and index is not None:
+                derivatives[index] += -0.5j*phase*(psi[0] if perm is None else psi[0, perm])
+
+        overlaps = derivatives @ psi[0].conj()
+        metric = (derivatives.conj() @ derivatives.T).real - np.outer(overlaps, overlaps.conj()).real
+        if blocks is None:
+            return metric
+        mask = np.zeros(metric.shape, dtype=bool)
+        for block in blocks:
+            mask[np.ix_(block, block)] = True
+        return np.where(mask, metric, 0)
+
+    def table(self, operator):
+        '''PauliTable of an opflow operator, converted once per operator'''
+        if isinstance(operator, PauliTable):
+            return operator
+        key = id(operator)
+        if key not in self._operators:
+            # keep a reference to the operator so that its id is not reused
+            self._operators[key] = (operator, PauliTable.from_operator(operator))
+        return self._operators[key][1]
+
+    def apply(self, operator, psi):
+        '''operator|psi>, matrix-free (see PauliTable.apply)'''
+        return self.table(operator).apply(psi)
+
+    def expectation(self, operator, psi):
+        '''
+        Args:
+            operator: PauliTable or opflow operator (e.g. from Hamiltonian.generate_XYZ)
+            psi: statevector, or (batch, 2**n) array of statevectors
+        Returns:
+            <psi|operator|psi>, one value per statevector
+        '''
+        return self.table(operator).expectation(psi)
@@ -0,0 +1,85 @@
+import asyncio
+
+from algorithms.profiling import profiler
+
+
+class BatchSubmission:
+    '''
+    Collects the circuits needed by one optimizer step (energy groups of every shifted parameter
+    set, overlaps with the lower levels, ...) and runs them as a single job, or as a few jobs of
+    at most max_circuits circuits, then hands every request back its own counts.
+
+    Synchronous use: add the requests, then flush. Asynchronous use: await counts(circuits) from
+    several tasks; the requests made in the same event loop iteration share one job, run in a
+    thread so that the event loop is not blocked.
+    '''
+
+    def __init__(self, executor, max_circuits=None, shots=None):
+        '''
+        Args:
+            executor: QuantumInstance (circuits transpiled by it beforehand), or a backend such as
+                a BasicAer/Aer simulator standing in for a remote device
+            max_circuits: maximum number of circuits per job, unbounded if None
+            shots: shots per circuit when executor is a backend
+        '''
+        self.executor = executor
+        self.max_circuits = max_circuits
+        self.shots = shots
+        self.jobs = 0
+        self._circuits = []
+        self._requests = []
+        self._flush = None
+
+    def add(self, circuits):
+        '''Queue circuits, returns the index of the request in the next flush'''
+        start = len(self._circuits)
+        self._circuits.extend(circuits)
+        self._requests.append((start, len(self._circuits)))
+        return len(self._requests) - 1
+
+    def flush(self):
+        '''Run the queued circuits, returns the list of counts of every request, in order'''
+        return self._execute(*self._take())
+
+    def _take(self):
+        queued = self._circuits, self._requests
+        self._circuits, self._requests = [], []
+        return queued
+
+    def _run(self, circuits):
+        with profiler.timer('sampling'):
+            if hasattr(self.executor, 'execute'):
+                result = self.executor.execute(circuits, had_transpiled=True)
+            else:
+                options = {} if self.shots is None else {'shots': self.shots}
+                result = self.executor.run(circuits, **options).result()
+        self.jobs += 1
+        counts = [result.get_counts(k) for k in range(len(circuits))]
+        if profiler.enabled:
+            profiler.count('jobs')
+            profiler.count('circuits', len(circuits))
+            profiler.count('shots', sum(sum(c.values()) for c in counts))
+        return counts
+
+    def _execute(self, circuits, requests):
+        size = self.max_circuits or max(len(circuits), 1)
+        counts = []
+        for start in range(0, len(circuits), size):
+            counts.extend(self._run(circuits[start:start + size]))
+        return [counts[start:stop] for start, stop in requests]
+
+    async def counts(self, circuits):
+        '''Queue circuits and wait for the job shared with the other requests of this step'''
+        loop = asyncio.get_running_loop()
+        index = self.add(circuits)
+        if self._flush is None:
+            self._flush = loop.create_task(self._flush_soon(loop))
+        results = await asyncio.shield(self._flush)
+        return results[index]
+
+    async def _flush_soon(self, loop):
+        # let the other requests of this event loop iteration queue their circuits first
+        await asyncio.sleep(0)
+        self._flush = None
+        queued = self._take()
+        return await loop.run_in_executor(None, self._execute, *queued)
@@ -0,0 +1,90 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from algorithms.statevector import StatevectorSimulator
+from algorithms.vqe import VQE
+
+
+def coupling_path(points):
+    '''
+    Order of the coupling points along a path, for continuation: starting from the smallest point,
+    the nearest point not visited yet comes next (a plain sort for a single varying coupling).
+
+    Args:
+        points: list of dicts of couplings, with the same keys
+    Returns:
+        list of indices into points
+    '''
+    keys = sorted(points[0])
+    values = np.array([[float(point[key]) for key in keys] for point in points])
+    remaining = list(np.lexsort(values.T[::-1]))
+    path = [remaining.pop(0)]
+    while remaining:
+        distances = np.linalg.norm(values[remaining] - values[path[-1]], axis=1)
+        path.append(remaining.pop(int(np.argmin(distances))))
+    return path
+
+
+def run_branch(points, hamiltonian, instance, n_qubits, n_layer, initial_parameters, n_levels=1,
+               updates=1, ansatz_options=None, shots=1):
+    '''
+    VQE of n_levels levels at every point of a branch of the path, in order, each level starting
+    from the parameters it converged to at the previous point (the first point starts from
+    initial_parameters).
+
+    Returns:
+        list of (point, level, energy, iterations, parameters)
+    '''
+    rows = []
+    previous = {}
+    for point in points:
+        vqe = VQE(hamiltonian(**point), n_qubits, instance(n_qubits), shots)
+        vqe.ansatz = vqe.ansatz(n_layer, **(ansatz_options or {}))
+        for level in range(n_levels):
+            parameters = previous.get(level, initial_parameters)
+            for _ in range(updates):
+                parameters = vqe.update(parameters, level)
+            optimal = vqe.optimal_parameters.get(str(level), parameters)
+            energy = vqe.excited_states(optimal, 0)[0]
+            rows.append((point, level, energy, len(vqe.cost[str(level)]) - 1, optimal))
+            previous[level] = optimal
+    return rows
+
+
+def sweep(points, hamiltonian, n_qubits, n_layer, initial_parameters, n_levels=1, instance=StatevectorSimulator,
+          updates=1, ansatz_options=None, shots=1, branches=1, workers=None):
+    '''
+    Warm-started VQE sweep over Hamiltonian couplings. The points are ordered along the coupling path and
+    cut into contiguous branches; the points of a branch are solved in order by continuation (see run_branch),
+    and the branches run in parallel worker processes.
+
+    Args:
+        points: list of dicts of keyword arguments of hamiltonian, e.g.
+            [dict(J_x=1, J_y=1, J_z=1, field=h, n_spins=4) for h in np.linspace(-2, 2, 40)]
+        hamiltonian: picklable callable returning the operator of a point, e.g. Hamiltonian.generate_XYZ
+        instance: picklable callable returning the instance of VQE from the number of qubits
+        branches: number of independent branches of the path (each one starts cold)
+        workers: number of worker processes, branches by default
+        (other arguments: see run_branch)
+    Returns:
+        result table, structured array with one row per point and level, in path order: the couplings,
+        'level', 'energy' and 'iterations' (AQGD iterations of the level)
+    '''
+    path = coupling_path(points)
+    parts = np.array_split(path, min(branches, len(path)))
+    args = (hamiltonian, instance, n_qubits, n_layer, initial_parameters, n_levels, updates, ansatz_options, shots)
+    if len(parts) == 1:
+        results = [run_branch([points[k] for k in parts[0]], *args)]
+    else:
+        # spawned workers: a fork after an Aer run in the parent process can deadlock
+        with ProcessPoolExecutor(workers or len(parts), mp_context=multiprocessing.get_context('spawn')) as executor:
+            futures = [executor.submit(run_branch, [points[k] for k in part], *args) for part in parts]
+            results = [future.result() for future in futures]
+
+    keys = sorted(points[0])
+    dtype = [(key, float) for key in keys] + [('level', int), ('energy', float), ('iterations', int)]
+    rows = [tuple(float(point[key]) for key in keys) + (level, energy, iterations)
+            for branch in results for point, level, energy, iterations, _ in branch]
+    return np.array(rows, dtype=dtype)
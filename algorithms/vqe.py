@@ -1,6 +1,8 @@
+import os
+import tempfile
 import numpy as np
 import scipy as sc
-from qiskit.circuit                        import QuantumCircuit,ClassicalRegister, QuantumRegister
+from qiskit.circuit                        import QuantumCircuit,ClassicalRegister, QuantumRegister, ParameterVector
 from qiskit.opflow.gradients               import Gradient
 from qiskit.opflow.state_fns               import CircuitStateFn, StateFn
 from qiskit.opflow.expectations            import PauliExpectation
@@ -16,7 +18,15 @@ from qiskit.opflow.expectations  import PauliExpectation, AerPauliExpectation, M
 
 # from qiskit.algorithms.optimizers.aqgd    import AQGD
 from algorithms.AQGD import AQGD
-from ansatz.ansatz import feature_map_ansatz
+from algorithms.exact_diagonalization import lowest_levels
+from algorithms.measurement import measurement_groups as group_measurements, counts_statistics
+from algorithms.parallel import EvaluationPool, statevector_energy, sampled_energy
+from algorithms.profiling import profiler, circuit_count, count_sampled
+from algorithms.shot_allocation import ShotAllocator
+from algorithms.submission import BatchSubmission
+from algorithms.statevector import StatevectorSimulator, circuit_gates, parameter_blocks
+from ansatz.ansatz import feature_map_ansatz, feature_map_template
+from pauli_table import PauliTable
 
 # Useful functions
 def projector_zero(n_qubits):
@@ -40,109 +50,577 @@ class VQE:
         self.optimal_parameters = {}
         self.cost               = {}
         self.shift_energy       = 100
+        # AQGD step mode ('gradient', 'natural' or 'newton') and natural gradient metric refresh
+        self.step_mode          = 'gradient'
+        self.metric_refresh     = 10
+        # commuting groups measured together (qubit-wise or general), with shots spread by a ShotAllocator
+        self.qubit_wise         = True
+        self.shot_allocator     = None
+        self._measurements      = None
+        self._groups            = None
+        # worker processes evaluating the parameter sets of an optimizer step (None: in process), and the
+        # picklable callable creating the backend of the sampled workers (None: the instance backend is sent)
+        self.workers            = None
+        self.backend_factory    = None
+        self.seed               = None
+        self._pool              = None
+        # objective evaluations grouped in one call by AQGD (bounded statevector batch memory)
+        self.max_evals_grouped  = max(1, 2**22 // 2**n_qubits)
+        self._template          = None
+        self._program           = None
+        self._expectation       = None
+        self._sampler           = None
+        self._fidelity          = None
+        self._references        = {}
+        self._overlap_circuits  = {}
+        # circuits per job of the batched submissions (None: a single job per optimizer step)
+        self.max_circuits       = None
+        # periodic checkpoints of the run (None: disabled), and the optimizer state to resume from
+        self.checkpoint_path    = None
+        self.checkpoint_every   = 5
+        self._optimizer_state   = None
+        # profile of the stages written at the end of every update (None: disabled), see algorithms.profiling
+        self.profile_path       = None
+        self._profiled          = False
 
 
     def ansatz(self, n_layer, entanglement_type = 'full', int_type = 'z', int_len=2, full_rotation = False,symmetric = False, feature_map = True):
 
-        ansatz = lambda parameter: feature_map_ansatz(parameter,self.n_qubits,n_layer,entanglement_type=entanglement_type, interaction_type= int_type,
+        circuit, theta = feature_map_template(self.n_qubits,n_layer,entanglement_type=entanglement_type, interaction_type= int_type,
             interaction_length=int_len, full_rotation=full_rotation,symmetric=symmetric)
+        ansatz = lambda parameter: circuit.assign_parameters(dict(zip(theta, parameter)))
 
         return ansatz
 
-    def excited_states(self,parameters,i):
-        #Make the operator measurable
-        op = StateFn(self.hamiltonian,is_measurement = True)
-
-        # create the wavefunction
-        wfn = CircuitStateFn(self.ansatz(parameter=parameters))
-
-        braket = op @ wfn  #matrix product
-
-        # Simulate the sampling
-        grouped = PauliExpectation().convert(braket)
-        sampled_op = CircuitSampler(self.instance).convert(grouped)
-
-        # Expectation value
-        mean_value = sampled_op.eval().real
-        est_err = 0
-        var_overlap = 0
-        for j in range(i):
-            overlap, var = self.overlap(parameters,j)
-            var_overlap += var
-            mean_value += self.shift_energy*overlap
+    def statevector(self,parameters):
+        '''
+        Simulate the ansatz with the NumPy statevector engine (instance is a StatevectorSimulator).
+        The ansatz is compiled once, from its circuit on symbolic parameters.
+        '''
+        if self._program is None:
+            circuit, theta = self.template(np.shape(parameters)[-1])
+            self._program = self.instance.compile(circuit_gates(circuit, theta))
+        return self.instance.statevector(self._program, parameters)
+
+    def template(self,n_params):
+        '''
+        The ansatz circuit on a ParameterVector, built once and then only bound.
+        Returns (circuit, parameters)
+        '''
+        if self._template is None:
+            with profiler.timer('circuit.construction'):
+                theta = ParameterVector('θ', n_params)
+                self._template = (self.ansatz(parameter=theta), theta)
+        return self._template
+
+    def _count_sampled(self,circuits):
+        '''Profile counters of circuits sampled by the instance, and of their shots'''
+        count_sampled(self.instance, circuits)
+
+    def sampled_energy(self,parameters):
+        '''
+        Sample the energy of the stacked parameter sets (2-D array) in a single CircuitSampler call.
+        The expectation is converted once and the sampler is kept, so the parametrized circuits are
+        transpiled once per instance and only bound afterwards.
+        '''
+        circuit, theta = self.template(np.shape(parameters)[-1])
+        if self._sampler is None or self._sampler[0] is not self.instance:
+            with profiler.timer('opflow.conversion'):
+                braket = StateFn(self.hamiltonian,is_measurement = True) @ CircuitStateFn(circuit)
+                self._expectation = PauliExpectation().convert(braket)
+            self._sampler = (self.instance, CircuitSampler(self.instance))
+
+        values = {p: parameters[:, k].tolist() for k, p in enumerate(theta)}
+        self._count_sampled(circuit_count(self._expectation)*len(parameters))
+        with profiler.timer('sampling'):
+            return self._sampler[1].convert(self._expectation, params=values)
+
+    def measurement_groups(self):
+        '''
+        Commuting groups of the Hamiltonian terms (qubit-wise if self.qubit_wise, general otherwise), as
+        (basis change circuit, (supports, coeffs)) with the observable of the group in the computational basis.
+        The basis changes are shared by all Hamiltonians of the same structure.
+        '''
+        if self._measurements is None or self._measurements[0] != self.qubit_wise:
+            table = PauliTable.from_operator(self.hamiltonian).simplify()
+            self._measurements = (self.qubit_wise, [(basis, (supports, signs*table.coeffs[group].real))
+                for group, basis, supports, signs in group_measurements(table, self.qubit_wise)])
+        return self._measurements[1]
+
+    def measured_circuits(self,circuit):
+        '''circuit followed by the basis change of every measurement group and a measurement'''
+        circuits = []
+        for basis, _ in self.measurement_groups():
+            measured = circuit.compose(basis)
+            measured.measure_all()
+            circuits.append(measured)
+        return circuits
+
+    def pool(self,n_params,level=0):
+        '''
+        EvaluationPool of self.workers processes, created at the first use, each holding the compiled ansatz
+        template and the Hamiltonian: the statevector engine with a StatevectorSimulator instance, otherwise
+        the measured circuits of the commuting groups sampled on a copy of the instance backend (or on the
+        backend of self.backend_factory).
+        The statevector workers also hold the reference states of the levels below level, the pool being
+        created again when they change, so that only parameter vectors are sent at every call.
+        '''
+        references = None
+        if isinstance(self.instance, StatevectorSimulator):
+            references = np.array([self.reference(j) for j in range(level)]).reshape(level, 2**self.n_qubits)
+            if self._pool is not None and not np.array_equal(self._pool[0], references):
+                self.close_pool()
+        if self._pool is None:
+            circuit, theta = self.template(n_params)
+            if isinstance(self.instance, StatevectorSimulator):
+                args = (self.n_qubits, circuit_gates(circuit, theta), PauliTable.from_operator(self.hamiltonian),
+                        references, self.shift_energy)
+                self._pool = (references, EvaluationPool(statevector_energy, args, self.workers, self.seed))
+            else:
+                args = (self.measured_circuits(circuit), list(theta), [obs for _, obs in self.measurement_groups()],
+                        self.backend_factory or self.instance.backend, self.instance.run_config.shots)
+                self._pool = (references, EvaluationPool(sampled_energy, args, self.workers, self.seed))
+        return self._pool[1]
+
+    def close_pool(self):
+        if self._pool is not None:
+            self._pool[1].close()
+            self._pool = None
+
+    def group_circuits(self,parameters):
+        '''
+        Ansatz template followed by the basis change of every measurement group and a measurement, transpiled
+        once per instance, then bound to the parameter set.
+        '''
+        circuit, theta = self.template(len(parameters))
+        if self._groups is None or self._groups[:2] != (self.instance, self.qubit_wise):
+            with profiler.timer('circuit.transpilation'):
+                circuits = self.instance.transpile(self.measured_circuits(circuit))
+            self._groups = (self.instance, self.qubit_wise, circuits)
+        with profiler.timer('circuit.binding'):
+            return [measured.assign_parameters({p: v for p, v in zip(theta, parameters) if p in measured.parameters})
+                    for measured in self._groups[2]]
+
+    def grouped_energy(self,parameters,submission=None):
+        '''
+        Sample the energy of the stacked parameter sets (2-D array) with one circuit per measurement group
+        and per parameter set. The circuits are queued in submission if given (see sampled_step), and run
+        in a single job otherwise.
+        Returns (energies, standard errors), or a function of the counts of the request returning them
+        '''
+        groups = self.measurement_groups()
+        shots = self.instance.run_config.shots
+
+        def statistics(counts):
+            values = np.array([counts_statistics(c, *groups[k % len(groups)][1]) for k, c in enumerate(counts)])
+            values = values.reshape(len(parameters), len(groups), 2)
+            return values[..., 0].sum(axis=1), np.sqrt(values[..., 1].sum(axis=1)/shots)
+
+        circuits = [circuit for row in parameters for circuit in self.group_circuits(row)]
+        if submission is not None:
+            return submission.add(circuits), statistics
+        submission = BatchSubmission(self.instance, self.max_circuits)
+        request = submission.add(circuits)
+        return statistics(submission.flush()[request])
+
+    def overlap_circuits(self,parameters,level):
+        '''
+        U(reference)|0> followed by U(parameters)^dagger and a measurement, for every parameter set: the probability
+        of measuring 0 is the overlap with the reference. Transpiled once per level, then bound.
+        '''
+        circuit, theta = self.template(parameters.shape[1])
+        key = str(level)
+        if key not in self._overlap_circuits:
+            reference = self.optimal_parameters[key]
+            bound = circuit.assign_parameters({p: v for p, v in zip(theta, reference) if p in circuit.parameters})
+            measured = bound.compose(circuit.inverse())
+            measured.measure_all()
+            with profiler.timer('circuit.transpilation'):
+                self._overlap_circuits[key] = self.instance.transpile(measured)[0]
+        measured = self._overlap_circuits[key]
+        with profiler.timer('circuit.binding'):
+            return [measured.assign_parameters({p: v for p, v in zip(theta, row) if p in measured.parameters})
+                    for row in parameters]
+
+    def sampled_step(self,parameters,i):
+        '''
+        Penalized energies of the stacked parameter sets of an optimizer step: the measurement groups of every
+        parameter set and the overlaps with the i lower levels are submitted together, as one batched job
+        (or a few of at most self.max_circuits circuits), and the counts are dispatched back.
+        Returns (values, standard errors)
+        '''
+        submission = BatchSubmission(self.instance, self.max_circuits)
+        energy_request, energy_statistics = self.grouped_energy(parameters, submission)
+        overlap_requests = [submission.add(self.overlap_circuits(parameters, j)) for j in range(i)]
+        counts = submission.flush()
+
+        mean_value, est_err = energy_statistics(counts[energy_request])
+        shots = self.instance.run_config.shots
+        for request in overlap_requests:
+            overlap = np.array([sum(n for key, n in c.items() if int(key.replace(' ', ''), 2) == 0)/sum(c.values())
+                                for c in counts[request]])
+            mean_value = mean_value + self.shift_energy*overlap
+            est_err = np.sqrt(est_err**2 + self.shift_energy**2*overlap*(1 - overlap)/shots)
+        return mean_value, est_err
 
-        # If the simulations is not unitary evolution, return an error bar
-        if (not self.instance.is_statevector):
-            variance = PauliExpectation().compute_variance(sampled_op).real + var_overlap
-            est_err  = np.sqrt(variance/shots)
+    def set_shot_allocation(self,**options):
+        '''
+        Sample energies with a ShotAllocator over the measurement groups (options are passed to it,
+        e.g. max_shots and target_error), starting from sigma <= sum |coeff| for every group.
+        '''
+        weights = [np.abs(coeffs).sum() for _, (_, coeffs) in self.measurement_groups()]
+        self.shot_allocator = ShotAllocator(weights, **options)
+
+    def allocated_energy(self,parameters):
+        '''
+        Energy sampled group by group, the shots being split by self.shot_allocator in proportion to
+        |coeff|*sigma of every group, and sampling stopping at its target error. The groups of a round
+        sharing the same allocation are run as one job at that number of shots.
+        Returns (energy, standard error)
+        '''
+        groups = self.measurement_groups()
+        circuits = self.group_circuits(parameters)
+
+        default_shots = self.instance.run_config.shots
+
+        def sample(shots):
+            means, variances = np.zeros(len(groups)), np.zeros(len(groups))
+            try:
+                for n_shots in np.unique(shots[shots > 0]):
+                    taken = np.flatnonzero(shots == n_shots)
+                    self.instance.set_config(shots=int(n_shots))
+                    with profiler.timer('sampling'):
+                        result = self.instance.execute([circuits[g] for g in taken], had_transpiled=True)
+                    profiler.count('jobs')
+                    self._count_sampled(len(taken))
+                    for k, g in enumerate(taken):
+                        means[g], variances[g] = counts_statistics(result.get_counts(k), *groups[g][1])
+            finally:
+                self.instance.set_config(shots=default_shots)
+            return means, variances
+
+        energy, error, _ = self.shot_allocator.estimate(sample)
+        return energy, error
 
+    def excited_states(self,parameters,i):
+        profiler.count('energy.evaluations', len(np.atleast_2d(parameters)))
+        if isinstance(self.instance, StatevectorSimulator) and self.workers and np.ndim(parameters) == 2 and len(parameters) > 1:
+            # stacked parameter sets: spread over the workers; single points are evaluated in process. With the
+            # adjoint gradient AQGD only evaluates single points, so in practice the pool serves the
+            # parameter-shift tables of the newton step mode and the gradient-free runs
+            with profiler.timer('pool.evaluation'):
+                return self.pool(np.shape(parameters)[-1], i)(parameters), np.zeros(len(parameters))
+
+        if isinstance(self.instance, StatevectorSimulator):
+            with profiler.timer('statevector.simulation'):
+                psi = self.statevector(parameters)
+            with profiler.timer('statevector.expectation'):
+                mean_value = self.instance.expectation(self.hamiltonian, psi)
+                if i > 0:
+                    # overlaps with all the lower levels as one product against the cached states
+                    references = np.array([self.reference(j) for j in range(i)])
+                    mean_value = mean_value + self.shift_energy*np.sum(np.abs(psi @ references.conj().T)**2, axis=-1)
+            return mean_value, 0
+
+        # Simulate the sampling, one binding of the ansatz template per parameter set
+        batch = np.atleast_2d(parameters)
+        lower_levels = range(i)
+        if self.instance.is_statevector:
+            sampled_op = self.sampled_energy(batch)
+            with profiler.timer('opflow.evaluation'):
+                mean_value = np.real(sampled_op.eval())
+            est_err = np.zeros(len(batch))
+        elif self.shot_allocator is not None:
+            mean_value, est_err = np.array([self.allocated_energy(row) for row in batch]).T
+        elif self.workers:
+            self._count_sampled(len(batch)*len(self.measurement_groups()))
+            with profiler.timer('pool.evaluation'):
+                mean_value, est_err = self.pool(batch.shape[1])(batch).T
+        else:
+            # energies and penalties of the whole step in one batched job
+            mean_value, est_err = self.sampled_step(batch, i)
+            lower_levels = ()
+
+        # Penalties of the lower levels, their error bars added in quadrature
+        for j in lower_levels:
+            overlap, err = self.overlap(batch,j)
+            mean_value = mean_value + self.shift_energy*overlap
+            est_err = np.sqrt(est_err**2 + (self.shift_energy*err)**2)
+
+        if np.ndim(parameters) == 1:
+            return mean_value[0], est_err[0]
         return mean_value, est_err
 
 
+    def gradient(self,parameters,i):
+        '''
+        Adjoint-mode gradient of excited_states(parameters, i) with the NumPy statevector engine,
+        the overlap penalties being part of the observable H + shift_energy*sum_j |j><j|.
+        '''
+        references = np.array([self.reference(j) for j in range(i)]).reshape(i, 2**self.n_qubits)
+
+        def observable(psi):
+            h_psi = self.instance.apply(self.hamiltonian, psi)
+            return h_psi + self.shift_energy*(psi @ references.conj().T) @ references
+
+        self.statevector(parameters)
+        return self.instance.gradient(self._program, parameters, observable)[1]
+
+    def metric(self,parameters):
+        '''
+        Block-diagonal Fubini-Study metric of the ansatz, one block per layer of rotations (see
+        parameter_blocks). Exact blocks with the NumPy engine; otherwise from the fidelity
+        F(s) = |<psi(parameters)|psi(parameters+s)>|^2 sampled at the +-pi/2 shifts of every pair of
+        parameters of a block, g_ij = -1/2 d_i d_j F, and at the pi shift of every parameter for the
+        diagonal (F(0) = 1 being known), in a single sampler call on a circuit transpiled once.
+        '''
+        circuit, theta = self.template(len(parameters))
+        blocks = parameter_blocks(circuit_gates(circuit, theta))
+        if isinstance(self.instance, StatevectorSimulator):
+            self.statevector(parameters)
+            return self.instance.metric(self._program, parameters, blocks)
+
+        n_params = len(parameters)
+        shifts, pairs = [], []
+        for block in blocks:
+            for a, i in enumerate(block):
+                # F(0) = 1 and F(pi e_i) = F(-pi e_i) for Pauli rotations: g_ii = (1 - F(pi e_i))/4
+                shift = np.zeros(n_params)
+                shift[i] = np.pi
+                shifts.append(shift)
+                pairs.append((i, i))
+                for j in block[a+1:]:
+                    for s_i, s_j in ((1, 1), (1, -1), (-1, 1), (-1, -1)):
+                        shift = np.zeros(n_params)
+                        shift[i] += s_i*np.pi/2
+                        shift[j] += s_j*np.pi/2
+                        shifts.append(shift)
+                    pairs.append((i, j))
+
+        expectation, sampler, reference = self.fidelity_expectation(n_params)
+        batch = np.asarray(parameters) + np.array(shifts)
+        values = {p: batch[:, k].tolist() for k, p in enumerate(theta)}
+        values.update({p: [v]*len(batch) for p, v in zip(reference, parameters)})
+        self._count_sampled(circuit_count(expectation)*len(batch))
+        with profiler.timer('sampling'):
+            sampled_op = sampler.convert(expectation, params=values)
+        fidelity = np.real(sampled_op.eval())
+
+        metric = np.zeros((n_params, n_params))
+        k = 0
+        for i, j in pairs:
+            if i == j:
+                metric[i, i] = (1 - fidelity[k])/4
+                k += 1
+            else:
+                f = fidelity[k:k + 4]
+                metric[i, j] = metric[j, i] = -(f[0] - f[1] - f[2] + f[3])/8
+                k += 4
+        return metric
+
+    def fidelity_expectation(self,n_params):
+        '''
+        |<psi(reference)|psi(parameters)>|^2 with both parameter sets symbolic, as the projection on |0> of
+        U(parameters)^dagger U(reference)|0>. Converted once per instance with a kept sampler, so that the
+        circuits are transpiled once and every metric refresh only binds them.
+        Returns (expectation, sampler, reference ParameterVector)
+        '''
+        circuit, theta = self.template(n_params)
+        if self._fidelity is None or self._fidelity[0] is not self.instance:
+            with profiler.timer('opflow.conversion'):
+                reference = ParameterVector('φ', n_params)
+                bound = circuit.assign_parameters({p: r for p, r in zip(theta, reference) if p in circuit.parameters})
+                proj0=StateFn(TensoredOp([self.P0] * (self.n_qubits)),is_measurement = True)
+                expectation = MatrixExpectation().convert(proj0 @ CircuitStateFn(bound.compose(circuit.inverse())))
+            self._fidelity = (self.instance, expectation, CircuitSampler(self.instance), reference)
+        return self._fidelity[1:]
+
+    def save_checkpoint(self,path,level=None,state=None):
+        '''
+        Write the run atomically (temporary file, then rename) to a compressed .npz file: optimal parameters and
+        cost history of every level, cached reference statevectors, and the optimizer state of the level in progress
+        (see AQGD.set_checkpoint).
+        '''
+        arrays = {}
+        for key, value in self.optimal_parameters.items():
+            arrays['optimal_parameters/' + key] = np.asarray(value)
+        for key, value in self.cost.items():
+            arrays['cost/' + key] = np.asarray(value, dtype=float)
+        for key, value in self._references.items():
+            # sampled references are circuits, rebuilt from the optimal parameters without simulation
+            if isinstance(value, np.ndarray):
+                arrays['reference/' + key] = value
+        if state is not None:
+            arrays['optimizer/level'] = np.asarray(level)
+            for name, value in state.items():
+                if value is not None:
+                    arrays['optimizer/' + name] = np.asarray(value)
+
+        directory = os.path.dirname(os.path.abspath(path))
+        with tempfile.NamedTemporaryFile(dir=directory, suffix='.npz', delete=False) as file:
+            np.savez_compressed(file, **arrays)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(file.name, path)
+
+    def load_checkpoint(self,path):
+        '''
+        Restore a run written by save_checkpoint. The next update of the level in progress resumes its optimization
+        where it stopped, mid-epoch if need be.
+        '''
+        state = {}
+        with np.load(path) as data:
+            for name in data.files:
+                kind, key = name.split('/', 1)
+                value = data[name]
+                if kind == 'optimal_parameters':
+                    self.optimal_parameters[key] = value
+                elif kind == 'cost':
+                    self.cost[key] = value.tolist()
+                elif kind == 'reference':
+                    self._references[key] = value
+                else:
+                    state[key] = value.item() if value.ndim == 0 else value
+        self._optimizer_state = (state.pop('level'), state) if state else None
+
     def update(self,parameters,level=0):
+        # the profile accumulates over the updates of this VQE, the process-wide profiler being switched
+        # off after each of them (unless it was already enabled by the caller)
+        profiling = self.profile_path is not None and not profiler.enabled
+        if profiling:
+            profiler.enable(reset=not self._profiled)
+            self._profiled = True
         try:
-            a = self.cost[str(level)]
-            parameters = self.optimal_parameters[str(level)]
-        except:
-            self.cost[str(level)] = list([self.excited_states(parameters,level)[0]])
+            return self._update(parameters, level)
+        finally:
+            if profiling:
+                profiler.dump(self.profile_path)
+                profiler.disable()
+
+    def _update(self,parameters,level):
+        state = None
+        if self._optimizer_state is not None and self._optimizer_state[0] == level:
+            # resume the interrupted optimization of this level
+            state = self._optimizer_state[1]
+            parameters = state['params']
+            self._optimizer_state = None
+        else:
+            try:
+                a = self.cost[str(level)]
+                parameters = self.optimal_parameters[str(level)]
+            except:
+                self.cost[str(level)] = list([self.excited_states(parameters,level)[0]])
 
         parameters = np.array(parameters)
-        AQGD_ = AQGD(maxiter= 50, eta = 0.1, tol= 1e-6,  momentum = 0.9, param_tol = 1e-6)
+        # natural gradient steps are about 4 times larger (metric 1/4 for Pauli rotations)
+        eta = 0.025 if self.step_mode == 'natural' else 0.1
+        AQGD_ = AQGD(maxiter= 50, eta = eta, tol= 1e-6,  momentum = 0.9, param_tol = 1e-6,
+            step_mode = self.step_mode, metric_refresh = self.metric_refresh)
+        AQGD_.set_max_evals_grouped(self.max_evals_grouped)
+        if self.checkpoint_path is not None:
+            AQGD_.set_checkpoint(lambda state: self.save_checkpoint(self.checkpoint_path, level, state), self.checkpoint_every)
+
+        gradient_function = None
+        if isinstance(self.instance, StatevectorSimulator):
+            gradient_function = lambda parameters: self.gradient(parameters,level)
 
         new_parameters, cost, _ = AQGD_.optimize(num_vars=len(parameters),objective_function= lambda parameters: self.excited_states(parameters,level)[0],
-        initial_point = parameters)
+        gradient_function = gradient_function, initial_point = parameters, metric_function = self.metric, state = state)
 
         self.cost[str(level)] += list(cost)
 
-        if cost[-1] <= min(self.cost[str(level)]):
+        # the optimal parameters are only replaced by better ones, but a level always gets some (the
+        # higher levels and the sweeps need a reference even when an earlier iterate had a lower cost)
+        if str(level) not in self.optimal_parameters or cost[-1] <= min(self.cost[str(level)]):
             self.optimal_parameters[str(level)] = new_parameters
+            # the cached reference state of this level is outdated
+            self._references.pop(str(level), None)
+            self._overlap_circuits.pop(str(level), None)
 
+        if self.checkpoint_path is not None:
+            self.save_checkpoint(self.checkpoint_path)
         return new_parameters
 
     def SWAP_test(self,parameters,j):
-        a = QuantumRegister(1,name='a')
-        q1 = QuantumRegister(self.n_qubits,name='q1')
-        q2 = QuantumRegister(self.n_qubits,name='q2')
-        swap_test = QuantumCircuit(a,q1,q2)
-        swap_test.h(a)
-        swap_test = swap_test.compose(self.ansatz(parameters),qubits= q1)
-        swap_test = swap_test.compose(self.ansatz(self.optimal_parameters[str(j)]),qubits= q2)
-        for i in range(self.n_qubits):
-            swap_test.cswap(a,q1[i],q2[i])
-        swap_test.h(a)
+        with profiler.timer('circuit.construction'):
+            a = QuantumRegister(1,name='a')
+            q1 = QuantumRegister(self.n_qubits,name='q1')
+            q2 = QuantumRegister(self.n_qubits,name='q2')
+            swap_test = QuantumCircuit(a,q1,q2)
+            swap_test.h(a)
+            swap_test = swap_test.compose(self.ansatz(parameters),qubits= q1)
+            swap_test = swap_test.compose(self.ansatz(self.optimal_parameters[str(j)]),qubits= q2)
+            for i in range(self.n_qubits):
+                swap_test.cswap(a,q1[i],q2[i])
+            swap_test.h(a)
 
         swap_test = CircuitStateFn(swap_test)
 
-        proj0=StateFn(TensoredOp([self.P0] * (self.n_qubits)),is_measurement = True)
-        braket = proj0 @ swap_test
-        grouped = MatrixExpectation().convert(braket)
-        sampled_op = CircuitSampler(self.instance).convert(grouped)
-        overlap = sampled_op.eval().real
-        var_overlap = 0
-
-        if (not self.instance.is_statevector):
-            variance = PauliExpectation().compute_variance(sampled_op).real
-            var_overlap  = np.sqrt(variance/shots)
+        with profiler.timer('opflow.conversion'):
+            proj0=StateFn(TensoredOp([self.P0] * (self.n_qubits)),is_measurement = True)
+            braket = proj0 @ swap_test
+            grouped = MatrixExpectation().convert(braket)
+        self._count_sampled(1)
+        with profiler.timer('sampling'):
+            sampled_op = CircuitSampler(self.instance).convert(grouped)
+        with profiler.timer('opflow.evaluation'):
+            overlap = sampled_op.eval().real
+            var_overlap = 0
+
+            if (not self.instance.is_statevector):
+                variance = PauliExpectation().compute_variance(sampled_op).real
+                var_overlap  = np.sqrt(variance/self.instance.run_config.shots)
 
         return overlap, var_overlap
 
-    def overlap(self,parameters, i):
-        #proj = self.projector(i)
-
+    def reference(self,level):
+        '''
+        Converged state of a lower level, cached until the level is re-optimized: its statevector
+        with the NumPy engine; otherwise the overlap expectation against the ansatz template, with
+        the reference circuit bound once and a sampler transpiling it once.
+        '''
+        key = str(level)
+        if key not in self._references:
+            parameters = self.optimal_parameters[key]
+            if isinstance(self.instance, StatevectorSimulator):
+                self._references[key] = self.statevector(parameters)
+            else:
+                self._references[key] = self.overlap_expectation(parameters)
+        return self._references[key]
+
+    def overlap_expectation(self,reference):
+        '''
+        |<psi(parameters)|psi(reference)>|^2 as the projection on |0> of U(parameters)^dagger U(reference)|0>,
+        with the reference circuit bound once and a sampler transpiling it once.
+        Returns (expectation, sampler), the expectation being parametrized by the ansatz template.
+        '''
+        circuit, theta = self.template(len(reference))
+        bound = circuit.assign_parameters({p: v for p, v in zip(theta, reference) if p in circuit.parameters})
         proj0=StateFn(TensoredOp([self.P0] * (self.n_qubits)),is_measurement = True)
-        #proj = self.projector(i)
-
-        out_product = CircuitStateFn(self.ansatz(parameters).inverse().compose(self.ansatz(self.optimal_parameters[str(i)])))
-        braket = proj0 @ out_product
-        grouped = MatrixExpectation().convert(braket)
-        sampled_op = CircuitSampler(self.instance).convert(grouped)
-        overlap = sampled_op.eval().real
-
-        var_overlap = 0
-        if (not self.instance.is_statevector):
-            variance = PauliExpectation().compute_variance(sampled_op).real
-            var_overlap  = np.sqrt(variance/shots)
+        expectation = MatrixExpectation().convert(proj0 @ CircuitStateFn(bound.compose(circuit.inverse())))
+        return expectation, CircuitSampler(self.instance)
 
+    def overlap(self,parameters, i):
+        if isinstance(self.instance, StatevectorSimulator):
+            with profiler.timer('statevector.overlap'):
+                return np.abs(self.statevector(parameters) @ self.reference(i).conj())**2, 0
+
+        expectation, sampler = self.reference(i)
+        batch = np.atleast_2d(parameters)
+        _, theta = self.template(batch.shape[1])
+        self._count_sampled(circuit_count(expectation)*len(batch))
+        with profiler.timer('sampling'):
+            sampled_op = sampler.convert(expectation, params={p: batch[:, k].tolist() for k, p in enumerate(theta)})
+        with profiler.timer('opflow.evaluation'):
+            overlap = np.real(sampled_op.eval())
+
+            var_overlap = np.zeros(len(batch))
+            if (not self.instance.is_statevector):
+                variance = np.real(PauliExpectation().compute_variance(sampled_op))
+                var_overlap  = np.sqrt(variance/self.instance.run_config.shots)
+
+        if np.ndim(parameters) == 1:
+            return overlap[0], var_overlap[0]
         return overlap, var_overlap
     '''
     def overlap(self,parameters,i):
@@ -154,7 +632,7 @@ class VQE:
         overlap = sampled_op.eval().real
         if (not self.instance.is_statevector):
             variance = PauliExpectation().compute_variance(sampled_op).real
-            var_overlap  = np.sqrt(variance/shots)
+            var_overlap  = np.sqrt(variance/self.shots)
         print("New overlap")
         return overlap, var_overlap
     '''
@@ -177,6 +655,9 @@ class VQE:
         energy, err = self.excited_states(self.optimal_parameters[str(level)],level)
 
 
-    def compute_exact_energy(self):
-        energies,_  = np.linalg.eigh(self.hamiltonian.to_matrix())
-        return energies
+    def compute_exact_energy(self,k=None):
+        '''
+        Lowest k exact energies (the whole spectrum if k is None): dense for small systems,
+        Lanczos (eigsh) on a sparse or matrix-free Hamiltonian for larger ones.
+        '''
+        return lowest_levels(self.hamiltonian,k)
@@ -1,5 +1,7 @@
 import numpy as np
+from functools import lru_cache
 from qiskit import QuantumCircuit, ClassicalRegister, QuantumRegister
+from qiskit.circuit import ParameterVector
 from ansatz.helper import *
 
 def feature_map_ansatz(parameter,n_qubits,n_layer,entanglement_type='full', interaction_type='z', interaction_length=2, full_rotation=False,symmetric=False):
@@ -53,3 +55,15 @@ def feature_map_ansatz(parameter,n_qubits,n_layer,entanglement_type='full', inte
         if symmetric:
             count +=1
     return circuit
+
+
+@lru_cache(maxsize=None)
+def feature_map_template(n_qubits,n_layer,entanglement_type='full', interaction_type='z', interaction_length=2, full_rotation=False,symmetric=False):
+    '''feature_map_ansatz built once per configuration on a ParameterVector, to be bound per evaluation
+    returns (circuit, parameters)
+    '''
+    parameters = ParameterVector('θ', get_len_param(n_qubits,n_layer,interaction_length,entanglement_type=entanglement_type,
+        symmetric=symmetric,full_rotation=full_rotation))
+    circuit = feature_map_ansatz(parameters,n_qubits,n_layer,entanglement_type=entanglement_type,interaction_type=interaction_type,
+        interaction_length=interaction_length,full_rotation=full_rotation,symmetric=symmetric)
+    return circuit, parameters
@@ -0,0 +1,250 @@
+'''
+Benchmark suite of the building blocks of the VQE and QAOA runs, sweeping the number of qubits and
+of layers. Every case reports its wall time (best and median of the repeats), its peak memory
+(tracemalloc, measured on a separate run so that tracing does not slow the timed ones) and the
+number of objective evaluations (and of gradient evaluations, for the AQGD steps), as JSON:
+
+    python -m benchmarks.suite --qubits 2 4 6 8 --layers 1 2 4 --output results.json
+
+Everything runs offline: the energies use the NumPy statevector engine, the SWAP test the local
+BasicAer simulator.
+'''
+import argparse
+import json
+import platform
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+from qiskit import BasicAer, QuantumCircuit, __version__ as qiskit_version
+from qiskit.circuit import ParameterVector
+from qiskit.utils import QuantumInstance
+
+from algorithms.AQGD import AQGD
+from algorithms.statevector import StatevectorSimulator, circuit_gates
+from algorithms.vqe import VQE
+from ansatz.ansatz import feature_map_ansatz
+from ansatz.helper import get_len_param, possible_pair
+from Hamiltonian import generate_XYZ
+from pauli_table import PauliTable
+
+ENTANGLEMENT_TYPES = ('linear', 'circular', 'full')
+
+
+class CountedObjective:
+    '''Objective function counting its evaluations, one per parameter set (row) it is called on'''
+
+    def __init__(self, objective):
+        self.objective = objective
+        self.evaluations = 0
+
+    def __call__(self, parameters):
+        self.evaluations += len(np.atleast_2d(parameters))
+        return self.objective(parameters)
+
+
+def measure(case, repeats):
+    '''
+    Args:
+        case: callable running the benchmarked code once, returning its number of objective
+            evaluations (None if it does not evaluate an objective), or a dict of named counts
+        repeats: number of timed runs
+    Returns:
+        dict of the wall time (best and median, in seconds), the peak memory (bytes) and the
+        number of objective evaluations (or the counts) of one run
+    '''
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        counts = case()
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        case()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    if not isinstance(counts, dict):
+        counts = dict(evaluations=counts)
+    return dict(wall_time=min(times), median_wall_time=float(np.median(times)), peak_memory=peak, **counts)
+
+
+def statevector_vqe(n_qubits, n_layer, entanglement_type='full'):
+    '''VQE of the XYZ chain on the NumPy statevector engine, returns (vqe, random parameters)'''
+    vqe = VQE(generate_XYZ(1, 1, 1, 1, n_spins=n_qubits), n_qubits, StatevectorSimulator(n_qubits), 1)
+    vqe.ansatz = vqe.ansatz(n_layer, entanglement_type=entanglement_type)
+    n_params = get_len_param(n_qubits, n_layer, 2, entanglement_type=entanglement_type)
+    return vqe, np.random.default_rng(0).uniform(0, 2*np.pi, n_params)
+
+
+def generate_xyz_case(n_qubits, n_layer):
+    def case():
+        generate_XYZ(1, 1, 1, 1, n_spins=n_qubits)
+    return case
+
+
+def ansatz_build_case(n_qubits, n_layer, entanglement_type):
+    parameters = np.zeros(get_len_param(n_qubits, n_layer, 2, entanglement_type=entanglement_type))
+
+    def case():
+        possible_pair(entanglement_type, 2, n_qubits)
+        feature_map_ansatz(parameters, n_qubits, n_layer, entanglement_type=entanglement_type)
+    return case
+
+
+def energy_case(n_qubits, n_layer):
+    vqe, parameters = statevector_vqe(n_qubits, n_layer)
+    objective = CountedObjective(lambda parameters: vqe.excited_states(parameters, 0)[0])
+    objective(parameters)   # compiles the ansatz
+
+    def case():
+        objective.evaluations = 0
+        objective(parameters)
+        return objective.evaluations
+    return case
+
+
+def aqgd_step_case(n_qubits, n_layer, adjoint=False):
+    '''
+    One AQGD iteration, parameter-shift gradient (2P+1 objective evaluations) or adjoint-mode gradient,
+    the gradient evaluations being counted separately
+    '''
+    vqe, parameters = statevector_vqe(n_qubits, n_layer)
+    objective = CountedObjective(lambda parameters: vqe.excited_states(parameters, 0)[0])
+    gradient_function = CountedObjective(lambda parameters: vqe.gradient(parameters, 0)) if adjoint else None
+    objective(parameters)
+
+    def case():
+        objective.evaluations = 0
+        if gradient_function is not None:
+            gradient_function.evaluations = 0
+        optimizer = AQGD(maxiter=1, eta=0.1, momentum=0.9)
+        optimizer.set_max_evals_grouped(vqe.max_evals_grouped)
+        optimizer.optimize(len(parameters), objective, gradient_function=gradient_function, initial_point=parameters)
+        return dict(evaluations=objective.evaluations,
+                    gradient_evaluations=gradient_function.evaluations if adjoint else 0)
+    return case
+
+
+def overlap_case(n_qubits, n_layer):
+    '''Overlap with a lower level on the statevector engine, the reference state being cached'''
+    vqe, parameters = statevector_vqe(n_qubits, n_layer)
+    vqe.optimal_parameters['0'] = parameters[::-1].copy()
+    vqe.overlap(parameters, 0)
+
+    def case():
+        vqe.overlap(parameters, 0)
+        return 1
+    return case
+
+
+def swap_test_case(n_qubits, n_layer, shots=1024):
+    '''SWAP test on 2*n_qubits+1 qubits, sampled on the BasicAer simulator'''
+    instance = QuantumInstance(BasicAer.get_backend('qasm_simulator'), shots=shots, seed_simulator=0,
+                               seed_transpiler=0)
+    vqe, parameters = statevector_vqe(n_qubits, n_layer)
+    vqe.instance = instance
+    vqe.optimal_parameters['0'] = parameters[::-1].copy()
+
+    def case():
+        vqe.SWAP_test(parameters, 0)
+        return 1
+    return case
+
+
+def maxcut_table(edges, n_qubits):
+    '''Cut size sum_(i,j) (1 - Z_i Z_j)/2 of the edges, as a PauliTable'''
+    labels = ['I'*n_qubits]
+    for i, j in edges:
+        label = ['I']*n_qubits
+        label[n_qubits - 1 - i] = label[n_qubits - 1 - j] = 'Z'
+        labels.append(''.join(label))
+    return PauliTable.from_labels(labels, [len(edges)/2] + [-0.5]*len(edges))
+
+
+def qaoa_case(n_qubits, n_layer):
+    '''QAOA expectation of the MaxCut of the ring, n_layer cost and mixer layers'''
+    edges = [(i, (i + 1) % n_qubits) for i in range(n_qubits if n_qubits > 2 else 1)]
+    angles = ParameterVector('angles', 2*n_layer)
+    circuit = QuantumCircuit(n_qubits)
+    circuit.h(range(n_qubits))
+    for p in range(n_layer):
+        for i, j in edges:
+            circuit.rzz(angles[2*p], i, j)
+        circuit.rx(angles[2*p + 1], range(n_qubits))
+
+    simulator = StatevectorSimulator(n_qubits)
+    program = simulator.compile(circuit_gates(circuit, angles))
+    table = maxcut_table(edges, n_qubits)
+    objective = CountedObjective(lambda parameters: table.expectation(simulator.statevector(program, parameters)))
+    parameters = np.random.default_rng(0).uniform(0, np.pi, 2*n_layer)
+
+    def case():
+        objective.evaluations = 0
+        objective(parameters)
+        return objective.evaluations
+    return case
+
+
+def cases(n_qubits, n_layer, swap_test=True):
+    '''Benchmark cases of a configuration, as (name, entanglement type or None, case)'''
+    yield 'generate_XYZ', None, generate_xyz_case(n_qubits, n_layer)
+    for entanglement_type in ENTANGLEMENT_TYPES:
+        yield 'ansatz_build', entanglement_type, ansatz_build_case(n_qubits, n_layer, entanglement_type)
+    yield 'energy', 'full', energy_case(n_qubits, n_layer)
+    yield 'aqgd_step', 'full', aqgd_step_case(n_qubits, n_layer)
+    yield 'aqgd_step_adjoint', 'full', aqgd_step_case(n_qubits, n_layer, adjoint=True)
+    yield 'overlap', 'full', overlap_case(n_qubits, n_layer)
+    if swap_test:
+        yield 'swap_test', 'full', swap_test_case(n_qubits, n_layer)
+    yield 'qaoa_expectation', None, qaoa_case(n_qubits, n_layer)
+
+
+def run(qubits, layers, repeats=5, only=None, swap_test=True):
+    '''
+    Args:
+        qubits, layers: numbers of qubits and of layers swept
+        repeats: timed runs per case
+        only: names of the cases to run, all of them if None
+        swap_test: include the (sampled) SWAP test
+    Returns:
+        JSON-serializable dict of the environment and of one record per case and configuration
+    '''
+    records = []
+    for n_qubits in qubits:
+        for n_layer in layers:
+            for name, entanglement_type, case in cases(n_qubits, n_layer, swap_test):
+                if only and name not in only:
+                    continue
+                record = dict(case=name, n_qubits=n_qubits, n_layer=n_layer, entanglement_type=entanglement_type,
+                              repeats=repeats)
+                record.update(measure(case, repeats))
+                records.append(record)
+    environment = dict(python=platform.python_version(), numpy=np.__version__, qiskit=qiskit_version,
+                       machine=platform.machine(), processor=platform.processor(), system=platform.system())
+    return dict(environment=environment, results=records)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0].strip())
+    parser.add_argument('--qubits', type=int, nargs='+', default=[2, 4, 6])
+    parser.add_argument('--layers', type=int, nargs='+', default=[1, 2])
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--only', nargs='+', help='names of the cases to run')
+    parser.add_argument('--no-swap-test', action='store_true', help='skip the sampled SWAP test')
+    parser.add_argument('--output', help='JSON file, standard output by default')
+    args = parser.parse_args(argv)
+
+    report = run(args.qubits, args.layers, args.repeats, args.only, not args.no_swap_test)
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main()
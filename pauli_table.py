@@ -0,0 +1,177 @@
+import numpy as np
+import scipy.sparse as sp
+from qiskit.quantum_info import SparsePauliOp
+from qiskit.opflow import PauliOp, PauliSumOp, SummedOp
+
+
+def bit_parity(values,mask):
+	'''parity of the bits of the integers values selected by mask'''
+	v = values & mask
+	for shift in (32,16,8,4,2,1):
+		v = v ^ (v >> shift)
+	return v & 1
+
+
+class PauliTable:
+	'''
+	Sum of Pauli strings in symplectic form: term t is coeffs[t] times the Pauli string with
+	X on the qubits where x[t] is set, Z where z[t] is set and Y where both are (qubit 0 is
+	column 0, as in qiskit's Pauli((z,x))).
+	'''
+
+	def __init__(self,x,z,coeffs):
+		self.x = np.atleast_2d(np.asarray(x,dtype=bool))
+		self.z = np.atleast_2d(np.asarray(z,dtype=bool))
+		self.coeffs = np.asarray(coeffs,dtype=complex).reshape(-1)
+		if self.x.shape != self.z.shape or len(self.coeffs) != len(self.x):
+			raise ValueError('x, z and coeffs describe different numbers of terms')
+		self._groups = None
+
+	@property
+	def n_qubits(self):
+		return self.x.shape[1]
+
+	def __len__(self):
+		return len(self.coeffs)
+
+	def __repr__(self):
+		return 'PauliTable({} terms, {} qubits)'.format(len(self),self.n_qubits)
+
+	@classmethod
+	def from_labels(cls,labels,coeffs):
+		'''
+		Args:
+			labels: Pauli labels such as 'IXZ', qubit 0 being the rightmost character
+			coeffs: coefficient of each label
+		'''
+		chars = np.array([list(label[::-1]) for label in labels])
+		x = (chars == 'X') | (chars == 'Y')
+		z = (chars == 'Z') | (chars == 'Y')
+		return cls(x,z,coeffs)
+
+	@classmethod
+	def from_operator(cls,operator):
+		'''Table of an opflow PauliOp, PauliSumOp or (nested) SummedOp of those'''
+		if isinstance(operator,PauliSumOp):
+			labels, coeffs = zip(*operator.primitive.to_list())
+			return cls.from_labels(labels,np.array(coeffs)*operator.coeff)
+		if isinstance(operator,PauliOp):
+			pauli = operator.primitive
+			phase = (-1j)**getattr(pauli,'phase',0)
+			return cls([pauli.x],[pauli.z],[phase*operator.coeff])
+		if isinstance(operator,SummedOp):
+			return cls.concatenate([cls.from_operator(op) for op in operator.oplist])*operator.coeff
+		raise TypeError('cannot build a PauliTable from {}'.format(type(operator).__name__))
+
+	@classmethod
+	def concatenate(cls,tables):
+		return cls(np.concatenate([t.x for t in tables]),np.concatenate([t.z for t in tables]),
+			np.concatenate([t.coeffs for t in tables]))
+
+	def __add__(self,other):
+		return PauliTable.concatenate([self,other])
+
+	def __mul__(self,scalar):
+		return PauliTable(self.x,self.z,scalar*self.coeffs)
+
+	__rmul__ = __mul__
+
+	def simplify(self,atol=1e-12):
+		'''Merge repeated Pauli strings and drop the terms with |coeff| <= atol'''
+		keys = np.packbits(np.hstack((self.x,self.z)),axis=1)
+		_, first, inverse = np.unique(keys,axis=0,return_index=True,return_inverse=True)
+		inverse = inverse.reshape(-1)
+		coeffs = np.zeros(len(first),dtype=complex)
+		np.add.at(coeffs,inverse,self.coeffs)
+		keep = np.abs(coeffs) > atol
+		# keep the order of first appearance
+		order = np.argsort(first[keep])
+		rows = first[keep][order]
+		return PauliTable(self.x[rows],self.z[rows],coeffs[keep][order])
+
+	def masks(self):
+		'''x and z of every term packed as integer bit masks (qubit i is bit i)'''
+		if self.n_qubits > 62:
+			raise ValueError('bit masks are limited to 62 qubits')
+		weights = np.left_shift(1,np.arange(self.n_qubits,dtype=np.int64))
+		return self.x @ weights, self.z @ weights
+
+	def labels(self):
+		chars = np.where(self.x & self.z,'Y',np.where(self.x,'X',np.where(self.z,'Z','I')))
+		return [''.join(row[::-1]) for row in chars]
+
+	def to_sparse_pauli_op(self):
+		if len(self) == 0:
+			return SparsePauliOp.from_list([('I'*self.n_qubits,0)])
+		return SparsePauliOp.from_list(list(zip(self.labels(),self.coeffs)))
+
+	def to_pauli_sum_op(self):
+		return PauliSumOp(self.to_sparse_pauli_op())
+
+	def save(self,file):
+		'''Write the table to a .npz file, with bit-packed x and z'''
+		np.savez_compressed(file,x=np.packbits(self.x,axis=1),z=np.packbits(self.z,axis=1),
+			coeffs=self.coeffs,n_qubits=self.n_qubits)
+
+	@classmethod
+	def load(cls,file):
+		with np.load(file) as data:
+			n = int(data['n_qubits'])
+			x = np.unpackbits(data['x'],axis=1,count=n)
+			z = np.unpackbits(data['z'],axis=1,count=n)
+			return cls(x,z,data['coeffs'])
+
+	def groups(self):
+		'''
+		Terms grouped by X mask, H = sum_g X^(m_g) D_g with D_g diagonal in the computational basis.
+		Computed once per table.
+
+		Returns:
+			masks (groups,) and diagonals (groups, 2**n), real when all of them are
+		'''
+		if self._groups is None:
+			xmask, zmask = self.masks()
+			n_y = np.sum(self.x & self.z,axis=1)
+			index = np.arange(2**self.n_qubits)
+			masks, inverse = np.unique(xmask,return_inverse=True)
+			diagonals = np.zeros((len(masks),len(index)),dtype=complex)
+			for t in range(len(self)):
+				# the Pauli string is i^n_y X^x Z^z
+				sign = 1 - 2*bit_parity(index,zmask[t])
+				diagonals[inverse.reshape(-1)[t]] += self.coeffs[t]*(1j**n_y[t])*sign
+			if not np.any(diagonals.imag):
+				diagonals = diagonals.real
+			self._groups = (masks,diagonals)
+		return self._groups
+
+	def apply(self,psi):
+		'''
+		H|psi> without building H: one bit-flip permutation and one phase vector per X mask,
+		O(groups * 2**n).
+
+		Args:
+			psi: statevector, or (batch, 2**n) array of statevectors
+		'''
+		masks, diagonals = self.groups()
+		index = np.arange(diagonals.shape[1])
+		h_psi = np.zeros(np.shape(psi),dtype=complex)
+		for mask, diagonal in zip(masks,diagonals):
+			moved = diagonal*psi
+			h_psi += moved if mask == 0 else moved[...,index ^ mask]
+		return h_psi
+
+	def expectation(self,psi):
+		'''<psi|H|psi> for a statevector, or one value per row of a (batch, 2**n) array'''
+		return np.sum(psi.conj()*self.apply(psi),axis=-1).real
+
+	def to_sparse(self):
+		'''CSR matrix of the sum, H[k, k^m_g] = D_g[k^m_g] (see groups)'''
+		masks, diagonals = self.groups()
+		dim = diagonals.shape[1]
+		index = np.arange(dim)
+		cols = np.concatenate([index ^ mask for mask in masks])
+		rows = np.tile(index,len(masks))
+		data = np.concatenate([diagonal[index ^ mask] for mask, diagonal in zip(masks,diagonals)])
+		matrix = sp.csr_matrix((data,(rows,cols)),shape=(dim,dim))
+		matrix.eliminate_zeros()
+		return matrix
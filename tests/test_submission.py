@@ -0,0 +1,81 @@
+'''
+Batched submissions (algorithms.submission) and the sampled optimizer step of VQE built on them,
+run on the local BasicAer simulator.
+'''
+import asyncio
+
+import numpy as np
+import pytest
+
+pytest.importorskip('qiskit')
+from qiskit import BasicAer, QuantumCircuit
+from qiskit.utils import QuantumInstance
+
+from algorithms.statevector import StatevectorSimulator
+from algorithms.submission import BatchSubmission
+from algorithms.vqe import VQE
+from ansatz.helper import get_len_param
+from Hamiltonian import generate_XYZ
+
+
+def basis_state(bits, n_qubits=2):
+    '''|bits> measured in the computational basis'''
+    circuit = QuantumCircuit(n_qubits)
+    for q in range(n_qubits):
+        if (bits >> q) & 1:
+            circuit.x(q)
+    circuit.measure_all()
+    return circuit
+
+
+def xyz_vqe(instance, n_qubits, n_layer):
+    vqe = VQE(generate_XYZ(1, 0.5, 0.3, 0.7, n_spins=n_qubits), n_qubits, instance, 1)
+    vqe.ansatz = vqe.ansatz(n_layer)
+    vqe.shift_energy = 2
+    return vqe
+
+
+def test_flush_dispatches_the_counts_of_every_request():
+    submission = BatchSubmission(BasicAer.get_backend('qasm_simulator'), max_circuits=2, shots=16)
+    first = submission.add([basis_state(1), basis_state(2)])
+    second = submission.add([basis_state(3)])
+    counts = submission.flush()
+    assert counts[first] == [{'01': 16}, {'10': 16}]
+    assert counts[second] == [{'11': 16}]
+    assert submission.jobs == 2
+
+
+def test_concurrent_requests_share_one_job():
+    submission = BatchSubmission(BasicAer.get_backend('qasm_simulator'), shots=8)
+
+    async def step():
+        return await asyncio.gather(submission.counts([basis_state(1)]), submission.counts([basis_state(2)]))
+
+    first, second = asyncio.run(step())
+    assert first == [{'01': 8}]
+    assert second == [{'10': 8}]
+    assert submission.jobs == 1
+
+
+@pytest.mark.parametrize('level', [1, 2])
+def test_sampled_step_with_lower_levels(level):
+    n_qubits, n_layer, shots = 2, 1, 20000
+    rng = np.random.default_rng(level)
+    n_params = get_len_param(n_qubits, n_layer, 2, entanglement_type='full')
+    references = rng.uniform(0, 2*np.pi, (level, n_params))
+    parameters = rng.uniform(0, 2*np.pi, (3, n_params))
+
+    exact = xyz_vqe(StatevectorSimulator(n_qubits), n_qubits, n_layer)
+    instance = QuantumInstance(BasicAer.get_backend('qasm_simulator'), shots=shots, seed_simulator=7,
+                               seed_transpiler=7)
+    sampled = xyz_vqe(instance, n_qubits, n_layer)
+    for j, reference in enumerate(references):
+        exact.optimal_parameters[str(j)] = sampled.optimal_parameters[str(j)] = reference
+
+    expected = exact.excited_states(parameters, level)[0]
+    values, errors = sampled.sampled_step(parameters, level)
+    assert values.shape == errors.shape == (len(parameters),)
+    assert np.all(errors > 0)
+    assert np.all(np.abs(values - expected) < 5*errors)
+    # the overlap circuits are transpiled once per level, then only bound
+    assert set(sampled._overlap_circuits) == {str(j) for j in range(level)}
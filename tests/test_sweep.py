@@ -0,0 +1,44 @@
+'''
+Warm-started coupling sweeps (algorithms.sweep), run end to end on the NumPy statevector engine.
+'''
+import numpy as np
+import pytest
+
+pytest.importorskip('qiskit')
+
+from algorithms.sweep import run_branch, sweep
+from algorithms.statevector import StatevectorSimulator
+from ansatz.helper import get_len_param
+from Hamiltonian import generate_XYZ
+
+N_QUBITS, N_LAYER = 3, 1
+
+
+def points(fields):
+    return [dict(J_x=1, J_y=0.5, J_z=0.3, field=h, n_spins=N_QUBITS) for h in fields]
+
+
+def initial_parameters():
+    n_params = get_len_param(N_QUBITS, N_LAYER, 2, entanglement_type='full')
+    return np.random.default_rng(0).uniform(0, 2*np.pi, n_params)
+
+
+def test_branch_reports_every_point_and_level():
+    rows = run_branch(points([0., 0.5]), generate_XYZ, StatevectorSimulator, N_QUBITS, N_LAYER,
+                      initial_parameters(), n_levels=2)
+    assert [(row[0]['field'], row[1]) for row in rows] == [(0., 0), (0., 1), (0.5, 0), (0.5, 1)]
+    for point, level, energy, iterations, optimal in rows:
+        assert np.isfinite(energy)
+        assert iterations >= 1
+        assert optimal.shape == initial_parameters().shape
+
+
+@pytest.mark.parametrize('branches', [1, 2])
+def test_sweep_is_variational(branches):
+    fields = [0.8, -0.4, 0.2, 0.]
+    table = sweep(points(fields), generate_XYZ, N_QUBITS, N_LAYER, initial_parameters(), branches=branches)
+    assert list(table['field']) == sorted(fields)
+    assert np.all(table['level'] == 0)
+    for row in table:
+        ground = np.linalg.eigvalsh(generate_XYZ(1, 0.5, 0.3, row['field'], n_spins=N_QUBITS).to_matrix())[0]
+        assert row['energy'] >= ground - 1e-8